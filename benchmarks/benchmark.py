@@ -0,0 +1,176 @@
+#!/usr/bin/python3 -u
+
+"""
+usage: benchmark.py [-h] [-o <path>] [-b <path>] [-t <ratio>] [-n <iterations>] [-p <port>] [-k <pattern>]
+
+Benchmarks zebr0's Client against a local TestServer, and writes the results as JSON.
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -o <path>, --output <path>
+                        path to the JSON file where to write the results, defaults to the standard output
+  -b <path>, --baseline <path>
+                        path to the JSON results of a previous run, to compare with
+  -t <ratio>, --threshold <ratio>
+                        relative slowdown of the median latency over which a scenario is flagged as a regression, defaults to 0.2
+  -n <iterations>, --iterations <iterations>
+                        number of lookups per scenario, defaults to 200
+  -p <port>, --port <port>
+                        port of the local TestServer, defaults to 8765
+  -k <pattern>, --scenarios <pattern>
+                        only runs the scenarios whose name contains this pattern
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # benchmarks the working copy rather than an installed version
+
+import zebr0  # noqa: E402
+
+LARGE_FILE_SIZE = 1024 * 1024
+CHAIN_LENGTH = 5
+THREADS = 8
+
+
+def measure(lookup: Callable[[], str], iterations: int, threads: int = 1) -> Dict[str, float]:
+    """
+    Runs a lookup several times, possibly from several threads at once, and computes its latency and throughput.
+
+    :param lookup: function to benchmark
+    :param iterations: total number of calls
+    :param threads: number of threads sharing the calls, defaults to 1
+    :return: the mean, median, 99th percentile latencies (in seconds) and the throughput (in lookups per second)
+    """
+
+    latencies = []
+
+    def worker(count):
+        for _ in range(count):
+            start = time.perf_counter()
+            lookup()
+            latencies.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=worker, args=(iterations // threads,)) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "iterations": len(latencies),
+        "mean": statistics.mean(latencies),
+        "p50": latencies[int(0.50 * (len(latencies) - 1))],
+        "p99": latencies[int(0.99 * (len(latencies) - 1))],
+        "throughput": len(latencies) / elapsed
+    }
+
+
+def build_scenarios(url: str, directory: Path) -> Tuple[Dict[str, Callable[[], Callable[[], str]]], Dict[str, str]]:
+    """
+    Builds the benchmark scenarios, each of them being a function that prepares a lookup to benchmark.
+    "cold" lookups use a new Client (and http session) each time, "warm" ones reuse a Client whose cache is already filled.
+
+    :param url: URL of the TestServer
+    :param directory: where to write the files for the "read" filter
+    :return: the scenarios by name, and the data of the TestServer
+    """
+
+    large_file = directory.joinpath("large_file")
+    large_file.write_text("x" * LARGE_FILE_SIZE)
+
+    def client(levels: List[str] = None, session_registry: zebr0.SessionRegistry = None) -> zebr0.Client:
+        return zebr0.Client(url, levels, configuration_file=Path(""), session_registry=session_registry)
+
+    def cold(key: str, levels: List[str] = None) -> Callable[[], Callable[[], str]]:
+        return lambda: lambda: client(levels, zebr0.SessionRegistry()).get(key)  # a registry of its own, as the shared one would answer from the cache of the previous Clients
+
+    def warm(key: str, levels: List[str] = None) -> Callable[[], Callable[[], str]]:
+        def prepare():
+            warm_client = client(levels)
+            warm_client.get(key)
+            return lambda: warm_client.get(key)
+        return prepare
+
+    scenarios = {}
+    for depth in [0, 2, 4]:
+        levels = [f"level{i}" for i in range(depth)]
+        scenarios[f"depth-{depth}-cold"] = cold("plain", levels)
+        scenarios[f"depth-{depth}-warm"] = warm("plain", levels)
+    scenarios["template-none-warm"] = warm("plain")
+    scenarios["template-get-chain-cold"] = cold("chain0")
+    scenarios["template-get-chain-warm"] = warm("chain0")
+    scenarios["template-read-large-warm"] = warm("read")
+    scenarios["concurrent-cold"] = cold("chain0")
+    scenarios["concurrent-warm"] = warm("chain0")
+
+    return scenarios, {
+        "plain": "lorem ipsum",
+        "read": "{{ '" + str(large_file) + "' | read }}",
+        **{f"chain{i}": "{{ 'chain" + str(i + 1) + "' | get }}" for i in range(CHAIN_LENGTH)},
+        f"chain{CHAIN_LENGTH}": "dolor sit amet"
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """
+    Compares the results with a baseline.
+
+    :param results: results of this run
+    :param baseline: results of a previous run
+    :param threshold: relative slowdown of the median latency over which a scenario is flagged
+    :return: a description of each regression
+    """
+
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and result["p50"] > baseline[name]["p50"] * (1 + threshold):
+            regressions.append(f"{name}: median latency {baseline[name]['p50'] * 1000:.3f}ms -> {result['p50'] * 1000:.3f}ms (+{result['p50'] / baseline[name]['p50'] - 1:.0%})")
+    return regressions
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Benchmarks zebr0's Client against a local TestServer, and writes the results as JSON.")
+    argparser.add_argument("-o", "--output", type=Path, help="path to the JSON file where to write the results, defaults to the standard output", metavar="<path>")
+    argparser.add_argument("-b", "--baseline", type=Path, help="path to the JSON results of a previous run, to compare with", metavar="<path>")
+    argparser.add_argument("-t", "--threshold", type=float, default=0.2, help="relative slowdown of the median latency over which a scenario is flagged as a regression, defaults to 0.2", metavar="<ratio>")
+    argparser.add_argument("-n", "--iterations", type=int, default=200, help="number of lookups per scenario, defaults to 200", metavar="<iterations>")
+    argparser.add_argument("-p", "--port", type=int, default=8765, help="port of the local TestServer, defaults to 8765", metavar="<port>")
+    argparser.add_argument("-k", "--scenarios", default="", help="only runs the scenarios whose name contains this pattern", metavar="<pattern>")
+    args = argparser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, zebr0.TestServer(port=args.port, engine="asyncio", access_logs_size=0) as server:
+        scenarios, server.data = build_scenarios(f"http://127.0.0.1:{args.port}", Path(directory))
+
+        for name, prepare in scenarios.items():
+            if args.scenarios in name:
+                results[name] = measure(prepare(), args.iterations, THREADS if name.startswith("concurrent") else 1)
+                print(f"{name}: p50 {results[name]['p50'] * 1000:.3f}ms, p99 {results[name]['p99'] * 1000:.3f}ms, {results[name]['throughput']:.0f}/s", file=sys.stderr)
+
+    results_string = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(results_string, zebr0.ENCODING)
+    else:
+        print(results_string)
+
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text(zebr0.ENCODING)), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/python3 -u
+
+"""
+usage: load.py [-h] [-o <path>] [-c <clients>] [-n <lookups>] [-d <depth>] [-l <seconds> [<seconds> ...]] [-w <bytes>] [-e <rate>] [-E <error> [<error> ...]] [-p <port>]
+
+Drives many zebr0 Clients at once against a local TestServer with injected latency and faults, and writes the latency distribution of their lookups as JSON.
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -o <path>, --output <path>
+                        path to the JSON file where to write the results, defaults to the standard output
+  -c <clients>, --clients <clients>
+                        number of Clients, each running in its own thread, defaults to 16
+  -n <lookups>, --lookups <lookups>
+                        number of lookups per Client, each of a different key, defaults to 100
+  -d <depth>, --depth <depth>
+                        number of levels of the Clients, the keys being defined at the root, defaults to 2
+  -l <seconds> [<seconds> ...], --latency <seconds> [<seconds> ...]
+                        latency of the server: either fixed, or uniformly distributed between two values, defaults to 0.01
+  -w <bytes>, --bandwidth <bytes>
+                        bandwidth of the server, in bytes per second, defaults to no limit
+  -e <rate>, --error-rate <rate>
+                        probability for a request to get an error, defaults to 0
+  -E <error> [<error> ...], --errors <error> [<error> ...]
+                        errors to inject: HTTP statuses, "reset" or "slow-headers", defaults to 500
+  -p <port>, --port <port>
+                        port of the local TestServer, defaults to 8766
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # loads the working copy rather than an installed version
+
+import zebr0  # noqa: E402
+
+
+def percentile(latencies: List[float], ratio: float) -> float:
+    """ Nearest-rank percentile of a sorted list of latencies. """
+    return latencies[int(ratio * (len(latencies) - 1))]
+
+
+def run(url: str, clients: int, lookups: int, depth: int) -> Dict[str, float]:
+    """
+    Runs several Clients at once, each looking up different keys, so that every lookup goes through the server.
+
+    :param url: URL of the TestServer
+    :param clients: number of Clients, each running in its own thread
+    :param lookups: number of lookups per Client
+    :param depth: number of levels of the Clients
+    :return: the number of lookups and errors, the median, 99th and 99.9th percentile latencies (in seconds) and the throughput (in lookups per second)
+    """
+
+    levels = [f"level{i}" for i in range(depth)]
+    latencies = []
+    errors = []
+
+    def worker():
+        client = zebr0.Client(url, levels, configuration_file=Path(""), session_registry=zebr0.SessionRegistry())  # a registry of its own, as the Clients of the shared one would answer each other from the cache
+        for i in range(lookups):
+            start = time.perf_counter()
+            try:
+                client.get(f"key{i}")
+                latencies.append(time.perf_counter() - start)
+            except Exception as error:  # e.g. a connection reset, counted rather than measured
+                errors.append(error)
+
+    workers = [threading.Thread(target=worker) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "lookups": len(latencies) + len(errors),
+        "errors": len(errors),
+        "p50": percentile(latencies, 0.50) if latencies else None,
+        "p99": percentile(latencies, 0.99) if latencies else None,
+        "p999": percentile(latencies, 0.999) if latencies else None,
+        "throughput": len(latencies) / elapsed
+    }
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Drives many zebr0 Clients at once against a local TestServer with injected latency and faults, and writes the latency distribution of their lookups as JSON.")
+    argparser.add_argument("-o", "--output", type=Path, help="path to the JSON file where to write the results, defaults to the standard output", metavar="<path>")
+    argparser.add_argument("-c", "--clients", type=int, default=16, help="number of Clients, each running in its own thread, defaults to 16", metavar="<clients>")
+    argparser.add_argument("-n", "--lookups", type=int, default=100, help="number of lookups per Client, each of a different key, defaults to 100", metavar="<lookups>")
+    argparser.add_argument("-d", "--depth", type=int, default=2, help="number of levels of the Clients, the keys being defined at the root, defaults to 2", metavar="<depth>")
+    argparser.add_argument("-l", "--latency", type=float, nargs="+", default=[0.01], help="latency of the server: either fixed, or uniformly distributed between two values, defaults to 0.01", metavar="<seconds>")
+    argparser.add_argument("-w", "--bandwidth", type=int, help="bandwidth of the server, in bytes per second, defaults to no limit", metavar="<bytes>")
+    argparser.add_argument("-e", "--error-rate", type=float, default=0, help="probability for a request to get an error, defaults to 0", metavar="<rate>")
+    argparser.add_argument("-E", "--errors", nargs="+", default=["500"], help='errors to inject: HTTP statuses, "reset" or "slow-headers", defaults to 500', metavar="<error>")
+    argparser.add_argument("-p", "--port", type=int, default=8766, help="port of the local TestServer, defaults to 8766", metavar="<port>")
+    args = argparser.parse_args()
+
+    latency = args.latency[0] if len(args.latency) == 1 else tuple(args.latency[:2])
+    errors = [int(error) if error.isdigit() else error for error in args.errors]
+    data = {f"key{i}": f"value{i}" for i in range(args.lookups)}
+
+    with zebr0.TestServer(data, port=args.port, engine="asyncio", access_logs_size=0, latency=latency, bandwidth=args.bandwidth, error_rate=args.error_rate, errors=errors):
+        results = run(f"http://127.0.0.1:{args.port}", args.clients, args.lookups, args.depth)
+
+    if results["p50"] is not None:
+        print(f"p50 {results['p50'] * 1000:.3f}ms, p99 {results['p99'] * 1000:.3f}ms, p999 {results['p999'] * 1000:.3f}ms, {results['throughput']:.0f}/s, {results['errors']} errors", file=sys.stderr)
+
+    results_string = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(results_string, zebr0.ENCODING)
+    else:
+        print(results_string)
+
+
+if __name__ == "__main__":
+    main()
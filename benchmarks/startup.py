@@ -0,0 +1,114 @@
+#!/usr/bin/python3 -u
+
+"""
+usage: startup.py [-h] [-o <path>] [-b <path>] [-t <ratio>] [-n <runs>] [-p <port>]
+
+Benchmarks the startup of zebr0 in fresh Python processes, as in short CLI invocations: the import time, and the time to the first lookup.
+
+optional arguments:
+  -h, --help            show this help message and exit
+  -o <path>, --output <path>
+                        path to the JSON file where to write the results, defaults to the standard output
+  -b <path>, --baseline <path>
+                        path to the JSON results of a previous run, to compare with
+  -t <ratio>, --threshold <ratio>
+                        relative slowdown of the median duration over which a scenario is flagged as a regression, defaults to 0.2
+  -n <runs>, --runs <runs>
+                        number of processes per scenario, defaults to 20
+  -p <port>, --port <port>
+                        port of the local TestServer, defaults to 8767
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))  # benchmarks the working copy rather than an installed version
+
+import zebr0  # noqa: E402
+from benchmark import compare  # noqa: E402
+
+# run in a fresh process, prints the duration from the beginning of the import to the end of the scenario
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import zebr0
+from pathlib import Path
+{}
+print(time.perf_counter() - start)
+"""
+
+SCENARIOS = {
+    "import": "",
+    "first-get-plain": "zebr0.Client(sys.argv[1], configuration_file=Path('')).get('plain')",
+    "first-get-template": "zebr0.Client(sys.argv[1], configuration_file=Path('')).get('template')",
+    "first-get-snapshot": "zebr0.Client(sys.argv[1], configuration_file=Path(''), snapshot_file=Path(sys.argv[2])).get('plain')"
+}
+
+
+def measure(scenario: str, runs: int, *args: str) -> Dict[str, float]:
+    """
+    Runs a scenario in several fresh processes, and computes its duration.
+
+    :param scenario: code to run after the import
+    :param runs: number of processes
+    :param args: arguments of the processes
+    :return: the mean, median and maximum durations (in seconds)
+    """
+
+    environment = dict(os.environ, PYTHONPATH=str(Path(__file__).resolve().parent.parent))
+    durations: List[float] = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", SCRIPT.format(scenario), *args], env=environment, capture_output=True, text=True, check=True).stdout
+        durations.append(float(output))
+
+    durations.sort()
+    return {
+        "runs": len(durations),
+        "mean": statistics.mean(durations),
+        "p50": durations[int(0.50 * (len(durations) - 1))],
+        "max": durations[-1]
+    }
+
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Benchmarks the startup of zebr0 in fresh Python processes, as in short CLI invocations: the import time, and the time to the first lookup.")
+    argparser.add_argument("-o", "--output", type=Path, help="path to the JSON file where to write the results, defaults to the standard output", metavar="<path>")
+    argparser.add_argument("-b", "--baseline", type=Path, help="path to the JSON results of a previous run, to compare with", metavar="<path>")
+    argparser.add_argument("-t", "--threshold", type=float, default=0.2, help="relative slowdown of the median duration over which a scenario is flagged as a regression, defaults to 0.2", metavar="<ratio>")
+    argparser.add_argument("-n", "--runs", type=int, default=20, help="number of processes per scenario, defaults to 20", metavar="<runs>")
+    argparser.add_argument("-p", "--port", type=int, default=8767, help="port of the local TestServer, defaults to 8767", metavar="<port>")
+    args = argparser.parse_args()
+
+    url = f"http://127.0.0.1:{args.port}"
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, zebr0.TestServer({"plain": "lorem ipsum", "template": "{{ 'plain' | get }}"}, port=args.port, access_logs_size=0):
+        snapshot_file = Path(directory).joinpath("snapshot")
+        zebr0.Client(url, configuration_file=Path("")).save_snapshot(["plain"], snapshot_file)
+
+        for name, scenario in SCENARIOS.items():
+            results[name] = measure(scenario, args.runs, url, str(snapshot_file))
+            print(f"{name}: p50 {results[name]['p50'] * 1000:.3f}ms, max {results[name]['max'] * 1000:.3f}ms", file=sys.stderr)
+
+    results_string = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(results_string, zebr0.ENCODING)
+    else:
+        print(results_string)
+
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text(zebr0.ENCODING)), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
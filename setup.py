@@ -11,7 +11,7 @@ setuptools.setup(
     url="https://zebr0.io",
     download_url="https://github.com/zebr0/zebr0.py",
     packages=["zebr0"],
-    scripts=["zebr0-setup"],
+    scripts=["zebr0-setup", "zebr0-render"],
     classifiers=[
         "Development Status :: 4 - Beta",
         "Environment :: Console",
@@ -26,7 +26,10 @@ setuptools.setup(
     ],
     license="MIT",
     install_requires=[
-        "requests-cache",
-        "jinja2"
-    ]
+        "requests-cache>=1.0",
+        "jinja2>=3.0"
+    ],
+    extras_require={
+        "async": ["aiohttp"]
+    }
 )
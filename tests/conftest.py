@@ -0,0 +1,9 @@
+import pytest
+
+import zebr0
+
+
+@pytest.fixture(autouse=True)
+def session_registry():
+    yield
+    zebr0.SESSION_REGISTRY.clear()  # the http sessions and their caches are shared by the Clients of a process, so each test starts afresh
@@ -7,16 +7,16 @@ import zebr0
 def test_defaults():
     argparser = zebr0.build_argument_parser()
     args = argparser.parse_args([])
-    assert args == argparse.Namespace(url=None, levels=None, cache=None, configuration_file=Path("/etc/zebr0.conf"))
+    assert args == argparse.Namespace(url=None, levels=None, cache=None, cache_file=None, snapshot_file=None, replicas=None, configuration_file=Path("/etc/zebr0.conf"))
 
 
 def test_long_parameters():
     argparser = zebr0.build_argument_parser()
-    args = argparser.parse_args(["--url", "http://localhost:8000", "--levels", "lorem", "ipsum", "--cache", "1", "--configuration-file", "/tmp/zebr0.conf"])
-    assert args == argparse.Namespace(url="http://localhost:8000", levels=["lorem", "ipsum"], cache=1, configuration_file=Path("/tmp/zebr0.conf"))
+    args = argparser.parse_args(["--url", "http://localhost:8000", "--levels", "lorem", "ipsum", "--cache", "1", "--cache-file", "/tmp/zebr0.cache", "--snapshot-file", "/tmp/zebr0.snapshot", "--replicas", "http://localhost:8001", "http://localhost:8002", "--configuration-file", "/tmp/zebr0.conf"])
+    assert args == argparse.Namespace(url="http://localhost:8000", levels=["lorem", "ipsum"], cache=1, cache_file=Path("/tmp/zebr0.cache"), snapshot_file=Path("/tmp/zebr0.snapshot"), replicas=["http://localhost:8001", "http://localhost:8002"], configuration_file=Path("/tmp/zebr0.conf"))
 
 
 def test_short_parameters():
     argparser = zebr0.build_argument_parser()
     args = argparser.parse_args(["-u", "http://localhost:8000", "-l", "lorem", "ipsum", "-c", "1", "-f", "/tmp/zebr0.conf"])
-    assert args == argparse.Namespace(url="http://localhost:8000", levels=["lorem", "ipsum"], cache=1, configuration_file=Path("/tmp/zebr0.conf"))
+    assert args == argparse.Namespace(url="http://localhost:8000", levels=["lorem", "ipsum"], cache=1, cache_file=None, snapshot_file=None, replicas=None, configuration_file=Path("/tmp/zebr0.conf"))
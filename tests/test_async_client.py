@@ -0,0 +1,126 @@
+import asyncio
+import time
+from pathlib import Path
+
+import pytest
+
+import zebr0
+
+pytest.importorskip("aiohttp")
+
+
+@pytest.fixture(scope="module")
+def server():
+    with zebr0.TestServer() as server:
+        yield server
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_levels(server):
+    server.data = {"lorem/ipsum/dolor": "sit amet", "consectetur/elit": "sed do", "incididunt": "ut labore"}
+
+    async def scenario():
+        async with zebr0.AsyncClient("http://127.0.0.1:8000", levels=["lorem", "ipsum"], configuration_file=Path("")) as client:
+            return await client.get("dolor"), await client.get("incididunt"), await client.get("elit"), await client.get("elit", default="default")
+
+    assert run(scenario()) == ("sit amet", "ut labore", "", "default")
+
+
+def test_concurrent_probing(server):
+    server.data = {"lorem/ipsum/dolor": "sit amet", "lorem/dolor": "consectetur", "incididunt": "ut labore"}
+
+    async def scenario():
+        async with zebr0.AsyncClient("http://127.0.0.1:8000", levels=["lorem", "ipsum"], configuration_file=Path(""), concurrent_probing=True) as client:
+            return await client.get("dolor"), await client.get("incididunt")
+
+    assert run(scenario()) == ("sit amet", "ut labore")
+
+
+def test_render(server):
+    server.data = {
+        "what": "memes",
+        "star_wars/what": "droids",
+        "star_wars/punctuation_mark": ".",
+        "star_wars/slang/punctuation_mark": ", duh!",
+        "template": "{{ levels[0] }}: these aren't the {{ 'what' | get }} you're looking for{{ 'punctuation_mark' | get }}\n"
+    }
+
+    async def scenario():
+        async with zebr0.AsyncClient("http://127.0.0.1:8000", levels=["star_wars", "slang"], configuration_file=Path("")) as client:
+            return await client.get("template"), await client.get("template", template=False, strip=False)
+
+    assert run(scenario()) == ("star_wars: these aren't the droids you're looking for, duh!", "{{ levels[0] }}: these aren't the {{ 'what' | get }} you're looking for{{ 'punctuation_mark' | get }}\n")
+
+
+def test_render_cycle(server):
+    server.data = {"lorem": "{{ 'ipsum' | get }}", "ipsum": "{{ 'lorem' | get }}"}
+
+    async def scenario():
+        async with zebr0.AsyncClient("http://127.0.0.1:8000", configuration_file=Path("")) as client:
+            return await client.get("lorem")
+
+    with pytest.raises(ValueError, match="reference cycle: lorem -> ipsum -> lorem"):
+        run(scenario())
+
+
+def test_get_many_and_request_sharing(server):
+    time.sleep(0.1)  # letting the useless requests from previous tests end
+    server.access_logs = []  # resetting server logs from previous tests
+
+    server.data = {"lorem/dolor": "sit amet", "elit": "{{ 'dolor' | get }}"}
+
+    async def scenario():
+        async with zebr0.AsyncClient("http://127.0.0.1:8000", levels=["lorem"], configuration_file=Path("")) as client:
+            return await asyncio.gather(client.get_many(["dolor", "elit", "aliqua"]), *[client.get("dolor") for _ in range(10)])
+
+    assert run(scenario()) == [{"dolor": "sit amet", "elit": "sit amet", "aliqua": ""}] + ["sit amet"] * 10
+    time.sleep(0.1)  # the server logs a request after answering it
+    assert sorted(server.access_logs) == ["/aliqua", "/dolor", "/elit", "/lorem/aliqua", "/lorem/dolor", "/lorem/elit"]  # each url is only requested once
+
+
+def test_cache(server):
+    server.access_logs = []  # resetting server logs from previous tests
+
+    server.data = {"ping": "pong"}
+
+    async def scenario():
+        async with zebr0.AsyncClient("http://127.0.0.1:8000", cache=1, configuration_file=Path("")) as client:
+            values = [await client.get("ping")]
+            server.data = {"ping": "peng"}
+            values.append(await client.get("ping"))
+            await asyncio.sleep(1.1)
+            values.append(await client.get("ping"))
+            return values
+
+    assert run(scenario()) == ["pong", "pong", "peng"]
+    assert server.access_logs == ["/ping", "/ping"]
+
+
+def test_configuration_file(server, tmp_path):
+    configuration_file = tmp_path.joinpath("zebr0.conf")
+    configuration_file.write_text('{"url": "http://127.0.0.1:8000", "levels": ["lorem", "ipsum"], "cache": 1}', zebr0.ENCODING)
+
+    server.data = {"lorem/ipsum/dolor": "sit amet"}
+
+    async def scenario():
+        async with zebr0.AsyncClient(configuration_file=configuration_file) as client:
+            return await client.get("dolor")
+
+    assert run(scenario()) == "sit amet"
+
+
+def test_timeout(monkeypatch):
+    monkeypatch.setattr(zebr0.SESSION_REGISTRY, "timeout", 0.2)
+
+    async def scenario():
+        async with zebr0.AsyncClient("http://127.0.0.1:8001", configuration_file=Path("")) as client:
+            return await client.get("lorem")
+
+    with zebr0.TestServer({"lorem": "ipsum"}, port=8001, latency=1):
+        start = time.perf_counter()
+        with pytest.raises(asyncio.TimeoutError):
+            run(scenario())
+        assert time.perf_counter() - start < 0.5
@@ -1,3 +1,5 @@
+import json
+
 import pytest
 
 import zebr0
@@ -24,3 +26,75 @@ def test_nominal(server, tmp_path, capsys):
     zebr0.main(["--url", "http://localhost:8000", "--levels", "lorem", "ipsum", "--cache", "1", "--configuration-file", str(file), "--test", "key"])
     assert capsys.readouterr().out == "value\n"
     assert file.read_text(zebr0.ENCODING) == '{"url": "http://localhost:8000", "levels": ["lorem", "ipsum"], "cache": 1}'
+
+
+def test_snapshot(server, tmp_path, capsys):
+    server.data = {"lorem/ipsum/key": "{{ 'other_key' | get }}", "other_key": "value"}
+    file = tmp_path.joinpath("zebr0.conf")
+    snapshot_file = tmp_path.joinpath("zebr0.snapshot")
+
+    zebr0.main(["--url", "http://localhost:8000", "--levels", "lorem", "ipsum", "--snapshot-file", str(snapshot_file), "--configuration-file", str(file), "--snapshot", "key"])
+    assert capsys.readouterr().out == ""
+    assert file.read_text(zebr0.ENCODING) == '{"url": "http://localhost:8000", "levels": ["lorem", "ipsum"], "cache": 300, "snapshot_file": "' + str(snapshot_file) + '"}'
+
+    server.data = {}  # from now on, the snapshot is enough
+    zebr0.main(["--url", "http://localhost:8000", "--levels", "lorem", "ipsum", "--snapshot-file", str(snapshot_file), "--configuration-file", str(file), "--test", "key"])
+    assert capsys.readouterr().out == "value\n"
+
+
+def test_snapshot_without_snapshot_file(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        zebr0.main(["--configuration-file", str(tmp_path.joinpath("zebr0.conf")), "--snapshot", "key"])
+    assert "--snapshot requires --snapshot-file" in capsys.readouterr().err
+
+
+def test_stats(server, tmp_path, capsys):
+    server.data = {"lorem/key": "value"}
+    file = tmp_path.joinpath("zebr0.conf")
+
+    zebr0.main(["--url", "http://localhost:8000", "--levels", "lorem", "ipsum", "--configuration-file", str(file), "--test", "key", "--stats"])
+    out, err = capsys.readouterr()
+    assert out == "value\n"
+    assert "lookups: 1\nprobes: 2\ncache_hits: 0\ncache_misses: 2\nnetwork: " in err
+
+
+def test_render(server, tmp_path, capsys):
+    server.data = {"lorem/ipsum/key": "{{ 'other_key' | get }}", "other_key": "value"}
+    file = tmp_path.joinpath("zebr0.conf")
+    file.write_text('{"url": "http://localhost:8000", "levels": ["lorem", "ipsum"], "cache": 1}', zebr0.ENCODING)
+    manifest = tmp_path.joinpath("manifest.json")
+    manifest.write_text(json.dumps({"key": str(tmp_path.joinpath("key")), "other_key": str(tmp_path.joinpath("other_key"))}), zebr0.ENCODING)
+
+    zebr0.main_render(["--configuration-file", str(file), str(manifest)])
+    assert capsys.readouterr().out == f"{tmp_path.joinpath('key')}\n{tmp_path.joinpath('other_key')}\n"
+    assert tmp_path.joinpath("key").read_text(zebr0.ENCODING) == "value"
+    assert tmp_path.joinpath("other_key").read_text(zebr0.ENCODING) == "value"
+
+    server.data["other_key"] = "new value"
+    zebr0.SESSION_REGISTRY.clear()  # forgets the cached responses
+    tmp_path.joinpath("key").write_text("new value", zebr0.ENCODING)
+    zebr0.main_render(["--configuration-file", str(file), str(manifest), "--stats"])
+    out, err = capsys.readouterr()
+    assert out == f"{tmp_path.joinpath('other_key')}\n"  # only the files that changed
+    assert "lookups: 1\n" in err
+
+
+def test_render_errors(server, tmp_path, capsys):
+    server.data = {"key": "value"}
+    file = tmp_path.joinpath("zebr0.conf")
+    file.write_text('{"url": "http://localhost:8000", "levels": [], "cache": 1}', zebr0.ENCODING)
+    manifest = tmp_path.joinpath("manifest.json")
+    manifest.write_text(json.dumps({"key": str(tmp_path.joinpath("key")), "missing": str(tmp_path.joinpath("missing"))}), zebr0.ENCODING)
+
+    with pytest.raises(SystemExit) as exit_info:
+        zebr0.main_render(["--configuration-file", str(file), str(manifest)])
+    assert exit_info.value.code == 1
+    assert capsys.readouterr().err == "keys not found, no file was written: missing\n"
+    assert not tmp_path.joinpath("key").exists()
+
+    with zebr0.TestServer({"key": "value"}, port=8001, error_rate=1, errors=[500]):
+        file.write_text('{"url": "http://localhost:8001", "levels": [], "cache": 1}', zebr0.ENCODING)
+        with pytest.raises(SystemExit) as exit_info:
+            zebr0.main_render(["--configuration-file", str(file), str(manifest)])
+        assert exit_info.value.code == 1
+        assert capsys.readouterr().err == "the server answered some requests with an error, no file was written\n"
@@ -1,7 +1,15 @@
+import io
+import json
+import os
+import stat
+import subprocess
+import sys
+import threading
 import time
 from pathlib import Path
 
 import pytest
+import requests
 
 import zebr0
 
@@ -46,6 +54,45 @@ def test_root_level(server):
     assert client.get("incididunt") == "ut labore"
 
 
+def test_concurrent_probing_deepest_level(server):
+    server.data = {"lorem/ipsum/dolor": "sit amet", "lorem/dolor": "consectetur", "dolor": "adipiscing"}
+    client = zebr0.Client("http://127.0.0.1:8000", levels=["lorem", "ipsum"], configuration_file=Path(""), concurrent_probing=True)
+
+    assert client.get("dolor") == "sit amet"
+
+
+def test_concurrent_probing_root_level(server):
+    time.sleep(0.1)  # letting the useless requests from previous tests end
+    server.access_logs = []  # resetting server logs from previous tests
+
+    server.data = {"incididunt": "ut labore"}
+    client = zebr0.Client("http://127.0.0.1:8000", levels=["eiusmod", "tempor", "magna"], configuration_file=Path(""), concurrent_probing=True)
+
+    assert client.get("incididunt") == "ut labore"
+    assert client.get("aliqua", default="default") == "default"
+    time.sleep(0.1)  # the server logs a request after answering it
+    assert sorted(server.access_logs) == ["/aliqua", "/eiusmod/aliqua", "/eiusmod/incididunt", "/eiusmod/tempor/aliqua", "/eiusmod/tempor/incididunt", "/eiusmod/tempor/magna/aliqua", "/eiusmod/tempor/magna/incididunt", "/incididunt"]
+
+
+def test_get_many(server):
+    time.sleep(0.1)  # letting the useless requests from previous tests end
+    server.access_logs = []  # resetting server logs from previous tests
+
+    server.data = {
+        "lorem/ipsum/dolor": "sit amet",
+        "lorem/elit": "sed do",
+        "incididunt": " {{ levels[0] }} ",
+        "lorem/ipsum": "labore"
+    }
+    client = zebr0.Client("http://127.0.0.1:8000", levels=["lorem", "ipsum"], configuration_file=Path(""))
+
+    assert client.get_many(["dolor", "elit", "incididunt", "aliqua"]) == {"dolor": "sit amet", "elit": "sed do", "incididunt": "lorem", "aliqua": ""}
+    assert client.get_many(["incididunt", "aliqua"], default="default", template=False, strip=False) == {"incididunt": " {{ levels[0] }} ", "aliqua": "default"}
+    assert client.get_many(["ipsum/ipsum", "ipsum"]) == {"ipsum/ipsum": "", "ipsum": "labore"}
+    time.sleep(0.1)  # the server logs a request after answering it
+    assert server.access_logs.count("/lorem/ipsum/ipsum") == 1  # shared by "ipsum/ipsum" at the root level and "ipsum" at the deepest level
+
+
 def test_missing_key_and_default_value(server):
     server.data = {}
     client = zebr0.Client("http://127.0.0.1:8000", levels=["dolore", "magna"], configuration_file=Path(""))
@@ -93,6 +140,35 @@ def test_recursive_nested_render(server):
     assert client.get("template") == "these aren't the droids you're looking for, duh!"
 
 
+def test_recursive_render_prefetch(server):
+    time.sleep(0.1)  # letting the useless requests from previous tests end
+    server.access_logs = []  # resetting server logs from previous tests
+
+    server.data = {
+        "template": "{{ 'lorem' | get }} {{ 'missing' | get('dolor') }} {{ 'missing' | get('dolor') }}",
+        "lorem": "{{ 'ipsum' | get }}",
+        "ipsum": "ipsum"
+    }
+    client = zebr0.Client("http://127.0.0.1:8000", configuration_file=Path(""))
+
+    assert client.get("template") == "ipsum dolor dolor"
+    time.sleep(0.1)  # the server logs a request after answering it
+    assert sorted(server.access_logs) == ["/ipsum", "/lorem", "/missing", "/template"]  # each key is only requested once
+
+
+def test_recursive_render_cycle(server):
+    server.data = {
+        "lorem": "{{ 'ipsum' | get }}",
+        "ipsum": "{{ 'dolor' | get }}",
+        "dolor": "{{ 'ipsum' | get }}"
+    }
+    client = zebr0.Client("http://127.0.0.1:8000", configuration_file=Path(""))
+
+    with pytest.raises(ValueError, match="reference cycle: ipsum -> dolor -> ipsum"):
+        client.get("lorem")
+    assert client.get("lorem", template=False) == "{{ 'ipsum' | get }}"
+
+
 def test_render_with_default(server):
     server.data = {"template": "{{ 'missing_key' | get('default') }}"}
     client = zebr0.Client("http://127.0.0.1:8000", configuration_file=Path(""))
@@ -100,6 +176,24 @@ def test_render_with_default(server):
     assert client.get("template") == "default"
 
 
+def test_template_cache(server):
+    server.data = {"template": "{{ url }}", "plain": "no template here"}
+    client = zebr0.Client("http://127.0.0.1:8000", configuration_file=Path(""), template_cache=1)
+
+    assert client.get("template") == "http://127.0.0.1:8000"
+    assert client.get("template") == "http://127.0.0.1:8000"
+    assert client.get("plain") == "no template here"  # no templating syntax, the templating engine isn't even called
+    assert client.compile_template.cache_info()[:4] == (1, 1, 1, 1)  # hits, misses, maximum size, current size
+
+
+def test_template_cache_newlines(server):
+    server.data = {"crlf": "lorem\r\nipsum"}
+    client = zebr0.Client("http://127.0.0.1:8000", configuration_file=Path(""))
+
+    assert client.get("crlf") == "lorem\nipsum"  # newlines are still normalized by the templating engine
+    assert client.get("crlf", template=False) == "lorem\r\nipsum"
+
+
 def test_read_ok(tmp_path, server):
     file = tmp_path.joinpath("file")
     file.write_text("content")
@@ -109,6 +203,17 @@ def test_read_ok(tmp_path, server):
     assert client.get("template") == "content"
 
 
+def test_read_changed(tmp_path, server):
+    file = tmp_path.joinpath("file")
+    file.write_text("content")
+    server.data = {"template": "{{ '" + str(file) + "' | read }}"}
+    client = zebr0.Client("http://127.0.0.1:8000", configuration_file=Path(""))
+
+    assert client.get("template") == "content"
+    file.write_text("new content")
+    assert client.get("template") == "new content"  # the compiled template is cached, but not the result of the filter
+
+
 def test_read_ko(tmp_path, server):
     server.data = {"template": "{{ '" + str(tmp_path.joinpath("unknown_file")) + "' | read }}"}
     client = zebr0.Client("http://127.0.0.1:8000", configuration_file=Path(""))
@@ -116,6 +221,29 @@ def test_read_ko(tmp_path, server):
     assert client.get("template") == ""
 
 
+def test_file_cache(tmp_path):
+    file_cache = zebr0.FileCache(max_size=16, mmap_threshold=8)
+    lorem, ipsum, dolor, sit = tmp_path.joinpath("lorem"), tmp_path.joinpath("ipsum"), tmp_path.joinpath("dolor"), tmp_path.joinpath("sit")
+    lorem.write_text("sit")
+    ipsum.write_bytes(b"amet\r\ncons")  # memory-mapped
+    dolor.write_text("too large to be cached")
+    sit.write_text("elit.")
+
+    assert file_cache.read(str(lorem)) == "sit"
+    assert file_cache.read(str(ipsum)) == "amet\ncons"  # same newline translation as Path.read_text()
+    assert file_cache.read(str(dolor)) == "too large to be cached"
+    assert file_cache.read(str(tmp_path)) == ""  # not a file
+    assert list(file_cache.entries) == [(str(lorem), "utf-8"), (str(ipsum), "utf-8")]
+    assert file_cache.size == 3 + 10
+
+    lorem.write_text("SIT")  # same size, but a new modification time
+    os.utime(lorem, ns=(0, 0))
+    assert file_cache.read(str(lorem)) == "SIT"
+    assert file_cache.read(str(sit)) == "elit."
+    assert list(file_cache.entries) == [(str(lorem), "utf-8"), (str(sit), "utf-8")]  # the least recently read file has been evicted
+    assert file_cache.size == 3 + 5
+
+
 def test_cache(server):
     server.access_logs = []  # resetting server logs from previous tests
 
@@ -138,6 +266,438 @@ def test_cache(server):
     assert server.access_logs == ["/ping", "/yin", "/ping", "/yin"]
 
 
+def test_lookup_cache(server):
+    server.access_logs = []  # resetting server logs from previous tests
+
+    server.data = {"incididunt": "ut labore"}
+    client = zebr0.Client("http://127.0.0.1:8000", levels=["eiusmod", "tempor"], cache=1, configuration_file=Path(""))
+
+    assert client.get("incididunt") == "ut labore"
+    assert client.get("aliqua") == ""
+    assert server.access_logs == ["/eiusmod/tempor/incididunt", "/eiusmod/incididunt", "/incididunt", "/eiusmod/tempor/aliqua", "/eiusmod/aliqua", "/aliqua"]
+
+    server.access_logs = []
+    server.data = {"eiusmod/incididunt": "dolore magna", "aliqua": "ut enim"}  # new values, shouldn't be used until cache has expired
+    assert client.get("incididunt") == "ut labore"  # the root level is known to answer, and its response is in cache
+    assert client.get("aliqua") == ""  # all the levels are known to be missing
+    assert server.access_logs == []
+
+    time.sleep(1.1)
+    assert client.get("incididunt") == "dolore magna"
+    assert client.get("aliqua") == "ut enim"
+    assert server.access_logs == ["/eiusmod/tempor/incididunt", "/eiusmod/incididunt", "/eiusmod/tempor/aliqua", "/eiusmod/aliqua", "/aliqua"]
+
+
+def test_stale_while_revalidate(server):
+    server.data = {"ping": "pong"}
+    client = zebr0.Client("http://127.0.0.1:8000", levels=["lorem"], cache=1, configuration_file=Path(""), stale_while_revalidate=True)
+
+    assert client.get("ping") == "pong"
+    server.data = {"ping": "peng", "lorem/ping": "pung"}
+    time.sleep(1.1)
+    assert client.get("ping") == "pong"  # the expired value is returned immediately, and refreshed in the background
+    time.sleep(0.2)
+    assert client.get("ping") == "pung"
+
+
+def test_get_to_file(server, tmp_path):
+    server.data = {"lorem/dolor": "  sit amet " * 100000 + "\n", "lorem/consectetur": "{% for i in range(3) %} {{ 'dolor' | get | length }} {% endfor %}"}
+    client = zebr0.Client("http://127.0.0.1:8000", levels=["lorem", "ipsum"], configuration_file=Path(""))
+    file = tmp_path.joinpath("file")
+
+    server.access_logs = []  # resetting server logs from previous tests
+    client.get_to_file("dolor", file, template=False, strip=False)
+    assert file.read_text(zebr0.ENCODING) == "  sit amet " * 100000 + "\n"
+    client.get_to_file("dolor", file, template=False)
+    assert file.read_text(zebr0.ENCODING) == ("  sit amet " * 100000).strip()
+    assert server.access_logs == ["/lorem/ipsum/dolor", "/lorem/dolor", "/lorem/dolor"]  # streamed values bypass the cache
+
+    buffer = io.BytesIO()
+    client.get_to_file("consectetur", buffer)
+    assert buffer.getvalue().decode(zebr0.ENCODING) == client.get("consectetur") == "1099997  1099997  1099997"
+
+    client.get_to_file("missing", file, default="  default ", template=False)
+    assert file.read_text(zebr0.ENCODING) == "default"
+
+    for default in ["", "   "]:
+        buffer = io.BytesIO()
+        client.get_to_file("missing", buffer, default=default, template=False)
+        assert buffer.getvalue() == b""
+
+    with pytest.raises(requests.ConnectionError):
+        zebr0.Client("http://127.0.0.1:8009", configuration_file=Path("")).get_to_file("dolor", file)
+    assert file.read_text(zebr0.ENCODING) == "default"  # left untouched
+    assert [path.name for path in tmp_path.iterdir()] == ["file"]
+
+
+class Polls:
+    """ Hook counting the polls of a watching Client, so that the tests wait for them rather than sleep. """
+
+    def __init__(self):
+        self.traces = []
+        self.condition = threading.Condition()
+
+    def __call__(self, trace):
+        with self.condition:
+            self.traces.append(trace)
+            self.condition.notify_all()
+
+    def wait(self, polls):
+        with self.condition:
+            count = len(self.traces) + polls
+            assert self.condition.wait_for(lambda: len(self.traces) >= count, timeout=5)
+
+
+class Changes(list):
+    """ Callback recording the changes notified by watch(), so that the tests wait for them rather than sleep. """
+
+    def __init__(self):
+        super().__init__()
+        self.condition = threading.Condition()
+
+    def __call__(self, key, value):
+        with self.condition:
+            self.append((key, value))
+            self.condition.notify_all()
+
+    def wait(self, count):
+        with self.condition:
+            assert self.condition.wait_for(lambda: len(self) >= count, timeout=5)
+
+
+def test_watch():
+    # a server of its own, that a late poll can't disturb the other tests with
+    with zebr0.TestServer({"ping": "pong", "yin": "yang", "template": "{{ 'ping' | get }}"}, port=8003) as server:
+        polls, changes = Polls(), Changes()
+        client = zebr0.Client("http://127.0.0.1:8003", configuration_file=Path(""), hooks=[polls])
+
+        stopped = client.watch(["ping", "yin", "template"], changes, interval=0.05)
+        try:
+            polls.wait(3)  # the callbacks of a poll are called before the next one starts
+            assert changes == []  # no change yet
+
+            server.data = {"ping": "peng", "yin": "yang", "template": "{{ 'ping' | get }}"}  # the values are in cache, but watching bypasses it
+            changes.wait(2)
+            polls.wait(3)
+            assert changes == [("ping", "peng"), ("template", "peng")]
+        finally:
+            stopped.set()
+
+        time.sleep(0.2)  # the poll in progress, if any, is over
+        count = len(polls.traces)
+        server.data = {"ping": "pung"}
+        time.sleep(0.2)
+        assert len(polls.traces) == count
+        assert changes == [("ping", "peng"), ("template", "peng")]
+
+
+def test_watch_levels():
+    with zebr0.TestServer({"lorem/ipsum/dolor": "sit", "lorem/amet": "consectetur"}, port=8003) as server:
+        polls, changes = Polls(), Changes()
+        client = zebr0.Client("http://127.0.0.1:8003", levels=["lorem", "ipsum"], configuration_file=Path(""), hooks=[polls])
+
+        stopped = client.watch(["dolor", "amet"], changes, interval=0.05)
+        try:
+            polls.wait(1)
+            assert polls.traces[-1]["probes"] == 3  # "/lorem/ipsum/dolor", "/lorem/ipsum/amet" and "/lorem/amet", the parent levels aren't polled
+
+            del server.data["lorem/ipsum/dolor"]
+            server.data["dolor"] = "adipiscing"
+            changes.wait(1)
+            assert changes == [("dolor", "adipiscing")]  # unless the level that answered doesn't anymore
+        finally:
+            stopped.set()
+
+
+def test_watch_errors(caplog):
+    with zebr0.TestServer({"ping": "pong", "template": "{{ 'ping' | get }}"}, port=8003) as server:
+        polls, changes = Polls(), Changes()
+        client = zebr0.Client("http://127.0.0.1:8003", configuration_file=Path(""), hooks=[polls])
+
+        def callback(key, value):
+            changes(key, value)
+            if value == "peng":
+                raise ValueError("faulty callback")
+
+        stopped = client.watch(["ping", "template"], callback, interval=0.05)
+        try:
+            server.data = {"ping": "peng", "template": "{{ 'ping' | get }}"}
+            changes.wait(2)
+            assert changes == [("ping", "peng"), ("template", "peng")]  # the other keys are still notified
+
+            server.data = {"ping": "peng", "template": "{{ 'ping' | get "}
+            deadline = time.monotonic() + 5
+            while sum("poll of" in record.message for record in caplog.records) < 2:  # the failing polls don't call the hooks
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            server.data = {"ping": "pung", "template": "{{ 'ping' | get }}"}
+            changes.wait(4)
+            assert changes == [("ping", "peng"), ("template", "peng"), ("ping", "pung"), ("template", "pung")]  # still watching
+        finally:
+            stopped.set()
+
+    assert "watch: callback failed for ping" in caplog.text
+    assert "watch: poll of ['ping', 'template'] failed" in caplog.text
+
+
+def test_thread_safety(server):
+    time.sleep(0.1)  # letting the useless requests from previous tests end
+    server.access_logs = []  # resetting server logs from previous tests
+
+    server.data = {"lorem/dolor": "sit amet", "elit": "{{ 'dolor' | get }}"}
+    client = zebr0.Client("http://127.0.0.1:8000", levels=["lorem"], configuration_file=Path(""))
+
+    barrier = threading.Barrier(20)
+    results = []
+
+    def worker():
+        barrier.wait()  # all the threads hit the client at the same moment
+        results.append((client.get("dolor"), client.get("elit"), client.get("aliqua", default="default")))
+
+    threads = [threading.Thread(target=worker) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [("sit amet", "sit amet", "default")] * 20
+    assert sorted(server.access_logs) == ["/aliqua", "/elit", "/lorem/aliqua", "/lorem/dolor", "/lorem/elit"]  # only one request per url
+
+
+def test_configuration_file_cache(server, tmp_path):
+    configuration_file = tmp_path.joinpath("zebr0.conf")
+    configuration_file.write_text('{"url": "http://127.0.0.1:8000", "levels": [], "cache": 1}', zebr0.ENCODING)
+
+    server.data = {"ping": "pong"}
+    client = zebr0.Client(configuration_file=configuration_file)
+
+    assert client.get("ping") == "pong"
+    server.data = {"ping": "peng"}
+    assert client.get("ping") == "pong"
+    time.sleep(1.1)
+    assert client.get("ping") == "peng"  # the cache duration from the configuration file is applied
+
+
+def test_cache_file(server, tmp_path):
+    server.access_logs = []  # resetting server logs from previous tests
+
+    server.data = {"ping": "pong"}
+    cache_file = tmp_path.joinpath("zebr0.cache")
+
+    assert zebr0.Client("http://127.0.0.1:8000", cache=1, configuration_file=Path(""), cache_file=cache_file).get("ping") == "pong"
+    assert zebr0.Client("http://127.0.0.1:8000", cache=1, configuration_file=Path(""), cache_file=cache_file).get("ping") == "pong"  # another client, same cache
+    assert server.access_logs == ["/ping"]
+
+    time.sleep(1.1)
+    assert zebr0.Client("http://127.0.0.1:8000", cache=1, configuration_file=Path(""), cache_file=cache_file).get("ping") == "pong"  # revalidated, the server answers 304
+    server.data = {"ping": "peng"}
+    time.sleep(1.1)
+    assert zebr0.Client("http://127.0.0.1:8000", cache=1, configuration_file=Path(""), cache_file=cache_file).get("ping") == "peng"
+    assert server.access_logs == ["/ping", "/ping", "/ping"]
+
+
+def test_prefetch(server):
+    server.data = {"lorem/ipsum/dolor": "sit amet", "lorem/elit": "sed do", "incididunt": "{{ 'dolor' | get }}", "other/dolor": "magna"}
+    client = zebr0.Client("http://127.0.0.1:8000", levels=["lorem", "ipsum"], cache=1, configuration_file=Path(""))
+
+    server.access_logs = []  # resetting server logs from previous tests
+    assert client.prefetch()
+    assert client.get_many(["dolor", "elit", "incididunt", "aliqua"]) == {"dolor": "sit amet", "elit": "sed do", "incididunt": "sit amet", "aliqua": ""}
+    assert server.access_logs == ["/?bundle=&bundle=lorem&bundle=lorem%2Fipsum"]  # a single http request
+
+    time.sleep(1.1)
+    assert client.get("dolor") == "sit amet"  # the bundle has expired
+    assert server.access_logs == ["/?bundle=&bundle=lorem&bundle=lorem%2Fipsum", "/lorem/ipsum/dolor"]
+
+
+def test_prefetch_not_supported(server, monkeypatch):
+    server.data = {"dolor": "sit amet"}
+    monkeypatch.setattr(server, "handle", lambda path, headers: (404, {}, b"") if path.startswith("/?") else zebr0.TestServer.handle(server, path, headers))
+    client = zebr0.Client("http://127.0.0.1:8000", configuration_file=Path(""))
+
+    assert not client.prefetch()
+    assert client.get("dolor") == "sit amet"
+
+
+def test_manifest(server):
+    server.data = {"lorem/ipsum/dolor": "sit amet", "incididunt": "ut labore"}
+    client = zebr0.Client("http://127.0.0.1:8000", levels=["lorem", "ipsum"], cache=1, configuration_file=Path(""), use_manifest=True)
+
+    server.access_logs = []  # resetting server logs from previous tests
+    assert client.get("dolor") == "sit amet"
+    assert client.get("incididunt") == "ut labore"
+    assert client.get("aliqua") == ""
+    assert server.access_logs == ["/?manifest=", "/lorem/ipsum/dolor", "/incididunt"]  # the other levels are known not to exist
+
+    server.data = {"lorem/ipsum/dolor": "sit amet", "incididunt": "ut labore", "lorem/aliqua": "ut enim"}
+    time.sleep(1.1)
+    assert client.get("aliqua") == "ut enim"  # the manifest has expired, and is refreshed
+    assert server.access_logs == ["/?manifest=", "/lorem/ipsum/dolor", "/incididunt", "/?manifest=", "/lorem/aliqua"]
+
+
+def test_manifest_invalid(server, monkeypatch):
+    server.data = {"lorem/ipsum/dolor": "sit amet"}
+    client = zebr0.Client("http://127.0.0.1:8000", levels=["lorem", "ipsum"], configuration_file=Path(""), use_manifest=True)
+
+    def http_get(url, **kwargs):
+        if "params" not in kwargs:
+            return http_get.wrapped(url, **kwargs)
+        response = requests.Response()
+        response.status_code, response._content = 200, b'["lorem/ipsum/dolor"]'  # valid JSON, but not a manifest
+        return response
+
+    http_get.wrapped = client._http_get
+    monkeypatch.setattr(client, "_http_get", http_get)
+    assert client.get("dolor") == "sit amet"  # as without a manifest
+
+
+def test_instrumentation(server, tmp_path):
+    file = tmp_path.joinpath("file")
+    file.write_text("consectetur", zebr0.ENCODING)
+    server.data = {"lorem/ipsum/dolor": "sit amet {{ 'elit' | get }}", "lorem/elit": "{{ '" + str(file) + "' | read }}"}
+    traces = []
+    client = zebr0.Client("http://127.0.0.1:8000", levels=["lorem", "ipsum"], configuration_file=Path(""), hooks=[traces.append])
+
+    assert client.get("dolor") == "sit amet consectetur"
+    assert client.get("dolor") == "sit amet consectetur"
+    assert client.get_many(["adipiscing", "elit"]) == {"adipiscing": "", "elit": "consectetur"}
+
+    client.executor.shutdown(wait=True)  # the requests still in flight are counted when they complete
+    assert [(trace["keys"], trace["levels"], trace["probes"], trace["cache_hits"], trace["cache_misses"]) for trace in traces] == [
+        (["dolor"], {"dolor": 2}, 4, 0, 4),  # "elit" is prefetched from all the levels at once
+        (["dolor"], {"dolor": 2}, 2, 2, 0),  # the levels are known, and the responses cached
+        (["adipiscing", "elit"], {"adipiscing": -1, "elit": 1}, 4, 1, 3)  # the 404s aren't cached
+    ]
+    for trace in traces:
+        assert trace["total"] >= trace["network"] + trace["templating"] + trace["read"]
+    assert traces[0]["read"] > 0
+
+    stats = client.stats()
+    assert stats["lookups"] == 3
+    assert stats["probes"] == 10
+    assert stats["cache_hits"] == 3
+    assert stats["total"] == pytest.approx(sum(trace["total"] for trace in traces))
+
+
+def test_lazy_setup(server, tmp_path):
+    code = "import sys, zebr0; print(sorted(sys.modules.keys() & {'asyncio', 'http.server', 'jinja2', 'requests', 'requests_cache'}))"
+    assert subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parent.parent, capture_output=True, text=True, check=True).stdout == "[]\n"  # the heavy dependencies are imported on first use
+
+    server.data = {"lorem": "ipsum", "dolor": "{{ 'lorem' | get }}"}
+    client = zebr0.Client("http://127.0.0.1:8000", configuration_file=Path(""))
+    assert client._http_session is None and client._jinja_environment is None
+
+    assert client.get("lorem") == "ipsum"
+    assert client._http_session is not None and client._jinja_environment is None
+
+    assert client.get("dolor") == "ipsum"
+    assert client._jinja_environment is not None
+
+
+def test_session_registry(server):
+    server.data = {"lorem/dolor": "sit amet", "ipsum/dolor": "consectetur"}
+    client1 = zebr0.Client("http://127.0.0.1:8000", levels=["lorem"], configuration_file=Path(""))
+    client2 = zebr0.Client("http://127.0.0.1:8000", levels=["ipsum"], configuration_file=Path(""))
+    client3 = zebr0.Client("http://localhost:8000", levels=["lorem"], configuration_file=Path(""))
+
+    assert client1.http_session is client2.http_session
+    assert client1.http_session is not client3.http_session
+
+    server.access_logs = []  # resetting server logs from previous tests
+    assert client1.get("dolor") == "sit amet"
+    assert zebr0.Client("http://127.0.0.1:8000", levels=["lorem"], configuration_file=Path("")).get("dolor") == "sit amet"
+    assert client2.get("dolor") == "consectetur"
+    assert server.access_logs == ["/lorem/dolor", "/ipsum/dolor"]  # the new Client uses the cache of the first one
+
+
+def test_session_registry_cache_duration(server):
+    server.data = {"ping": "pong"}
+    client1 = zebr0.Client("http://127.0.0.1:8000", cache=300, configuration_file=Path(""))
+    client2 = zebr0.Client("http://127.0.0.1:8000", cache=1, configuration_file=Path(""))
+
+    assert client1.http_session is not client2.http_session
+    assert client1.get("ping") == "pong"
+    assert client2.get("ping") == "pong"
+
+    server.data = {"ping": "peng"}
+    time.sleep(1.1)
+    assert client1.get("ping") == "pong"
+    assert client2.get("ping") == "peng"  # each Client gets its own cache duration
+
+
+def test_session_registry_timeout_and_pool_size():
+    with zebr0.TestServer({"lorem": "ipsum", "dolor": "sit"}, port=8001, engine="asyncio", overrides={"dolor": {"latency": 1}}) as server:
+        session_registry = zebr0.SessionRegistry(pool_size=2, timeout=0.5)
+
+        client = zebr0.Client("http://127.0.0.1:8001", configuration_file=Path(""), session_registry=session_registry)
+        with pytest.raises(requests.Timeout):
+            client.get("dolor")
+
+        server.latency = 0.2
+        threads = [threading.Thread(target=zebr0.Client("http://127.0.0.1:8001", configuration_file=Path(""), session_registry=session_registry).get, args=("lorem",)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        assert len(server.connections) == 2  # the other requests wait for a free connection
+        for thread in threads:
+            thread.join()
+
+        session_registry.clear()
+
+
+def test_snapshot(server, tmp_path):
+    server.data = {
+        "lorem/ipsum/dolor": "{{ 'sit' | get }} {{ 'amet' | get('default') }}",
+        "lorem/sit": "sit",
+        "consectetur": "adipiscing"
+    }
+    snapshot_file = tmp_path.joinpath("zebr0.snapshot")
+    zebr0.Client("http://127.0.0.1:8000", levels=["lorem", "ipsum"], configuration_file=Path("")).save_snapshot(["dolor"], snapshot_file)
+
+    time.sleep(0.1)  # the requests for the parent levels may still be in flight
+    server.access_logs = []  # resetting server logs from previous tests
+    client = zebr0.Client("http://127.0.0.1:8000", levels=["lorem", "ipsum"], configuration_file=Path(""), snapshot_file=snapshot_file)
+    assert client.get("dolor") == "sit default"
+    assert server.access_logs == []  # all the keys were in the snapshot, even the missing ones
+    assert client.get("consectetur") == "adipiscing"  # not in the snapshot
+    assert server.access_logs == ["/lorem/ipsum/consectetur", "/lorem/consectetur", "/consectetur"]
+
+    client = zebr0.Client("http://127.0.0.1:8000", levels=["lorem"], configuration_file=Path(""), snapshot_file=snapshot_file)
+    assert client.get("dolor") == ""  # the snapshot was compiled for other levels, it's ignored
+
+
+def test_snapshot_thread_safety(tmp_path):
+    snapshot_file = tmp_path.joinpath("zebr0.snapshot")
+    values = {f"key{i}": f"value{i}" for i in range(200000)}
+    snapshot_file.write_text(json.dumps({"url": "http://127.0.0.1:8009", "levels": [], "values": {**values, "fqdn": "host"}}), zebr0.ENCODING)
+    client = zebr0.Client("http://127.0.0.1:8009", configuration_file=Path(""), snapshot_file=snapshot_file)  # nothing listens there
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.get("fqdn"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["host"] * 8  # no thread went to the network while the snapshot was being read
+
+
+def test_snapshot_invalid(server, tmp_path):
+    server.data = {"lorem": "ipsum"}
+    snapshot_file = tmp_path.joinpath("zebr0.snapshot")
+
+    for content in ['{"url": "http://127.0.0.1:8000", "levels": [], "val', '{"lorem": "dolor"}', '["lorem"]', '{"url": "http://127.0.0.1:8000", "levels": [], "values": "lorem"}']:
+        snapshot_file.write_text(content, zebr0.ENCODING)
+        client = zebr0.Client("http://127.0.0.1:8000", configuration_file=Path(""), snapshot_file=snapshot_file)
+        assert client.get("lorem") == "ipsum"  # truncated or foreign files are ignored
+
+    with pytest.raises(ValueError):
+        zebr0.Client("http://127.0.0.1:8000", configuration_file=Path("")).save_snapshot(["lorem"])
+
+    client.save_snapshot(["lorem"])
+    assert json.loads(snapshot_file.read_text(zebr0.ENCODING))["values"] == {"lorem": "ipsum"}
+    assert [path.name for path in tmp_path.iterdir()] == ["zebr0.snapshot"]
+
+
 def test_configuration_file(server, tmp_path):
     configuration_file = tmp_path.joinpath("zebr0.conf")
     configuration_file.write_text('{"url": "http://127.0.0.1:8000", "levels": ["lorem", "ipsum"], "cache": 1}', zebr0.ENCODING)
@@ -155,3 +715,143 @@ def test_save_configuration(tmp_path):
     client.save_configuration(configuration_file)
 
     assert configuration_file.read_text(zebr0.ENCODING) == '{"url": "http://127.0.0.1:8000", "levels": ["lorem", "ipsum"], "cache": 1}'
+
+
+def test_save_configuration_with_cache_file(tmp_path):
+    client = zebr0.Client("http://127.0.0.1:8000", levels=["lorem", "ipsum"], cache=1, configuration_file=Path(""), cache_file=Path("/tmp/zebr0.cache"))
+
+    configuration_file = tmp_path.joinpath("zebr0.conf")
+    client.save_configuration(configuration_file)
+
+    assert configuration_file.read_text(zebr0.ENCODING) == '{"url": "http://127.0.0.1:8000", "levels": ["lorem", "ipsum"], "cache": 1, "cache_file": "/tmp/zebr0.cache"}'
+    assert zebr0.Client(configuration_file=configuration_file).cache_file == Path("/tmp/zebr0.cache")
+
+
+def test_replicas_failover():
+    with zebr0.TestServer({"lorem": "ipsum"}, port=8001, error_rate=1, errors=[503]) as failing, zebr0.TestServer({"lorem": "ipsum", "dolor": "sit"}, port=8002) as replica:
+        client = zebr0.Client("http://127.0.0.1:8009", configuration_file=Path(""), replicas=["http://127.0.0.1:8001", "http://127.0.0.1:8002"])
+
+        assert client.get("lorem") == "ipsum"  # nothing listens on the main url, and the first replica fails
+        assert len(failing.access_logs) == 1
+        assert replica.access_logs == ["/lorem"]
+        assert set(client.failing_servers) == {"http://127.0.0.1:8009", "http://127.0.0.1:8001"}
+
+        assert client.get("dolor") == "sit"
+        assert len(failing.access_logs) == 1  # the failing servers are now tried last
+        assert replica.access_logs == ["/lorem", "/dolor"]
+
+
+def test_replicas_failover_streaming(tmp_path):
+    with zebr0.TestServer({"lorem": "ipsum"}, port=8001, error_rate=1, errors=[503]), zebr0.TestServer({"lorem": "ipsum"}, port=8002):
+        client = zebr0.Client("http://127.0.0.1:8009", configuration_file=Path(""), replicas=["http://127.0.0.1:8001", "http://127.0.0.1:8002"])
+
+        client.get_to_file("lorem", tmp_path.joinpath("lorem"), template=False)
+        assert tmp_path.joinpath("lorem").read_text(zebr0.ENCODING) == "ipsum"
+
+
+def test_replicas_all_failing():
+    client = zebr0.Client("http://127.0.0.1:8009", configuration_file=Path(""), replicas=["http://127.0.0.1:8008"])
+    with pytest.raises(requests.ConnectionError):
+        client.get("lorem")
+
+
+def test_replicas_hedging():
+    with zebr0.TestServer({"lorem": "ipsum"}, port=8001, latency=1) as slow, zebr0.TestServer({"lorem": "ipsum"}, port=8002) as replica:
+        client = zebr0.Client("http://127.0.0.1:8001", configuration_file=Path(""), replicas=["http://127.0.0.1:8002"], hedge_percentile=0.9)
+        client.latencies.extend([0.05] * zebr0.HEDGE_MIN_SAMPLES)  # as if the servers used to be fast
+
+        start = time.perf_counter()
+        assert client.get("lorem") == "ipsum"
+        assert time.perf_counter() - start < 0.5  # the replica answered while the main url was late
+        assert replica.access_logs == ["/lorem"]
+        assert not client.failing_servers  # slow isn't failing
+
+        time.sleep(1)
+        assert slow.access_logs == ["/lorem"]
+
+
+def test_save_configuration_with_replicas(tmp_path):
+    client = zebr0.Client("http://127.0.0.1:8000", levels=["lorem", "ipsum"], cache=1, configuration_file=Path(""), replicas=["http://127.0.0.1:8001"])
+
+    configuration_file = tmp_path.joinpath("zebr0.conf")
+    client.save_configuration(configuration_file)
+
+    assert configuration_file.read_text(zebr0.ENCODING) == '{"url": "http://127.0.0.1:8000", "levels": ["lorem", "ipsum"], "cache": 1, "replicas": ["http://127.0.0.1:8001"]}'
+    assert zebr0.Client(configuration_file=configuration_file).replicas == ["http://127.0.0.1:8001"]
+
+
+def test_render_to_files(server, tmp_path):
+    server.data = {"lorem": "{{ 'dolor' | get }} amet", "ipsum": "{{ 'dolor' | get }} ipsum", "dolor": "sit"}
+    lorem_file, ipsum_file = tmp_path.joinpath("lorem"), tmp_path.joinpath("some/directory/ipsum")
+    client = zebr0.Client("http://127.0.0.1:8000", configuration_file=Path(""))
+
+    assert client.render_to_files({"lorem": lorem_file, "ipsum": ipsum_file}) == {"lorem": True, "ipsum": True}
+    assert lorem_file.read_text(zebr0.ENCODING) == "sit amet"
+    assert ipsum_file.read_text(zebr0.ENCODING) == "sit ipsum"
+
+    lorem_file.chmod(0o600)
+    server.data["dolor"] = "consectetur"
+    zebr0.SESSION_REGISTRY.clear()  # forgets the cached responses
+    client = zebr0.Client("http://127.0.0.1:8000", configuration_file=Path(""))
+
+    assert client.render_to_files({"lorem": lorem_file, "ipsum": ipsum_file, "missing": tmp_path.joinpath("missing")}, default="default") == {"lorem": True, "ipsum": True, "missing": True}
+    assert lorem_file.read_text(zebr0.ENCODING) == "consectetur amet"
+    assert stat.S_IMODE(lorem_file.stat().st_mode) == 0o600  # the permissions are kept
+    assert tmp_path.joinpath("missing").read_text(zebr0.ENCODING) == "default"
+    assert not list(tmp_path.glob("**/*.tmp"))
+
+    server.data["ipsum"] = "consectetur ipsum"  # same rendering
+    zebr0.SESSION_REGISTRY.clear()  # forgets the cached responses
+    client = zebr0.Client("http://127.0.0.1:8000", configuration_file=Path(""))
+    mtime = ipsum_file.stat().st_mtime_ns
+    assert client.render_to_files({"lorem": lorem_file, "ipsum": ipsum_file}) == {"lorem": False, "ipsum": False}
+    assert ipsum_file.stat().st_mtime_ns == mtime  # unchanged files aren't written
+
+
+def test_render_to_files_errors(server, tmp_path):
+    server.data = {"lorem": "ipsum"}
+    lorem_file, dolor_file = tmp_path.joinpath("lorem"), tmp_path.joinpath("dolor")
+    lorem_file.write_text("good config", zebr0.ENCODING)
+    client = zebr0.Client("http://127.0.0.1:8000", configuration_file=Path(""))
+
+    with pytest.raises(LookupError):
+        client.render_to_files({"lorem": lorem_file, "dolor": dolor_file})
+    assert lorem_file.read_text(zebr0.ENCODING) == "good config"  # all or nothing
+    assert not dolor_file.exists()
+
+    with zebr0.TestServer({"lorem": "ipsum"}, port=8001, error_rate=1, errors=[500]):
+        client = zebr0.Client("http://127.0.0.1:8001", configuration_file=Path(""))
+        with pytest.raises(requests.HTTPError):
+            client.render_to_files({"lorem": lorem_file}, default="")
+        assert lorem_file.read_text(zebr0.ENCODING) == "good config"
+        assert client.stats()["errors"] == 1
+
+
+def test_render_to_files_temporary_files(server, tmp_path):
+    server.data = {"lorem": "ipsum", "dolor": "sit"}
+    client = zebr0.Client("http://127.0.0.1:8000", configuration_file=Path(""))
+
+    assert client.render_to_files({"lorem": tmp_path.joinpath("file"), "dolor": tmp_path.joinpath("file.tmp")}) == {"lorem": True, "dolor": True}
+    assert tmp_path.joinpath("file").read_text(zebr0.ENCODING) == "ipsum"
+    assert tmp_path.joinpath("file.tmp").read_text(zebr0.ENCODING) == "sit"  # temporary files have unique names
+    assert stat.S_IMODE(tmp_path.joinpath("file").stat().st_mode) == 0o666 & ~client._umask()
+
+    with pytest.raises(OSError):
+        with client._atomic_file(tmp_path.joinpath("file")) as file:
+            file.write(b"partial")
+            raise OSError("disk full")
+    assert tmp_path.joinpath("file").read_text(zebr0.ENCODING) == "ipsum"
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["file", "file.tmp"]  # no leftover
+
+
+def test_render_to_files_symbolic_link(server, tmp_path):
+    server.data = {"lorem": "ipsum"}
+    tmp_path.joinpath("directory").mkdir()
+    target, link = tmp_path.joinpath("directory", "target"), tmp_path.joinpath("link")
+    target.write_text("dolor", zebr0.ENCODING)
+    link.symlink_to(target)
+
+    assert zebr0.Client("http://127.0.0.1:8000", configuration_file=Path("")).render_to_files({"lorem": link}) == {"lorem": True}
+    assert link.is_symlink()  # the link is kept
+    assert target.read_text(zebr0.ENCODING) == "ipsum"
+    assert [path.name for path in tmp_path.joinpath("directory").iterdir()] == ["target"]
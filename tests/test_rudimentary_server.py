@@ -1,3 +1,7 @@
+import socket
+import time
+
+import pytest
 import requests
 
 import zebr0
@@ -70,3 +74,154 @@ def test_access_logs():
         requests.get("http://127.0.0.1:8000/dolor/sit")
 
         assert server.access_logs == ["/lorem", "/lorem", "/dolor/sit"]
+
+
+def test_etag():
+    with zebr0.TestServer({"key": "value"}) as server:
+        etag = requests.get("http://127.0.0.1:8000/key").headers["ETag"]
+
+        response = requests.get("http://127.0.0.1:8000/key", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert response.text == ""
+
+        server.data = {"key": "new value"}
+
+        response = requests.get("http://127.0.0.1:8000/key", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        assert response.text == "new value"
+
+
+def test_bundle():
+    with zebr0.TestServer({"lorem": "ipsum", "dolor/sit": "amet", "dolor/sit/amet": "consectetur", "dolorem": "ipsum", "adipiscing": ""}):
+        response = requests.get("http://127.0.0.1:8000/?bundle=dolor")
+        assert response.ok
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.json() == {"dolor/sit": "amet", "dolor/sit/amet": "consectetur"}
+
+        response = requests.get("http://127.0.0.1:8000/?bundle=dolor/sit&bundle=", headers={"Accept-Encoding": "identity"})
+        assert "Content-Encoding" not in response.headers
+        assert response.json() == {"lorem": "ipsum", "dolor/sit": "amet", "dolor/sit/amet": "consectetur", "dolorem": "ipsum"}
+
+        assert requests.get("http://127.0.0.1:8000/?unknown").status_code == 400
+
+
+def test_manifest():
+    with zebr0.TestServer({"lorem": "ipsum", "dolor/sit": "amet", "adipiscing": ""}) as server:
+        manifest = requests.get("http://127.0.0.1:8000/?manifest").json()
+        assert manifest["keys"] == ["dolor/sit", "lorem"]
+
+        server.data = {"lorem": "ipsum", "dolor/sit": "amet", "adipiscing": "elit"}
+        new_manifest = requests.get("http://127.0.0.1:8000/?manifest").json()
+        assert new_manifest["keys"] == ["adipiscing", "dolor/sit", "lorem"]
+        assert new_manifest["version"] != manifest["version"]
+
+
+def test_asyncio_engine():
+    with zebr0.TestServer({"key": "value"}, engine="asyncio") as server:
+        response = requests.get("http://127.0.0.1:8000/key")
+        assert response.ok
+        assert response.text == "value"
+        assert requests.get("http://127.0.0.1:8000/?manifest").json()["keys"] == ["key"]
+
+        etag = response.headers["ETag"]
+        assert requests.get("http://127.0.0.1:8000/key", headers={"If-None-Match": etag}).status_code == 304
+        assert requests.get("http://127.0.0.1:8000/missing").status_code == 404
+
+        assert server.access_logs == ["/key", "/?manifest", "/key", "/missing"]
+
+
+def test_asyncio_engine_keep_alive():
+    with zebr0.TestServer({"lorem": "ipsum", "dolor": "sit"}, engine="asyncio") as server:
+        with requests.Session() as session:
+            assert session.get("http://127.0.0.1:8000/lorem").text == "ipsum"
+            assert session.get("http://127.0.0.1:8000/missing").status_code == 404
+            assert session.get("http://127.0.0.1:8000/dolor").text == "sit"
+            assert len(server.connections) == 1  # a single persistent connection
+
+
+def test_asyncio_engine_pipelining():
+    with zebr0.TestServer({"lorem": "ipsum", "dolor": "sit"}, engine="asyncio") as server:
+        with socket.create_connection(("127.0.0.1", 8000)) as connection:
+            connection.sendall(b"GET /lorem HTTP/1.1\r\nHost: localhost\r\n\r\nGET /dolor HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+
+            responses = b""
+            while chunk := connection.recv(4096):
+                responses += chunk
+
+        assert responses.count(b"HTTP/1.1 200 OK") == 2
+        assert responses.index(b"ipsum") < responses.index(b"sit")
+        assert server.access_logs == ["/lorem", "/dolor"]
+
+
+def test_bounded_access_logs():
+    with zebr0.TestServer({"key": "value"}, access_logs_size=2) as server:
+        for path in ["/lorem", "/lorem", "/dolor/sit", "/key"]:
+            requests.get("http://127.0.0.1:8000" + path)
+
+        assert server.access_logs == ["/dolor/sit", "/key"]
+        assert server.access_logs[-1:] == ["/key"]
+        assert server.access_logs.total == 4
+        assert server.access_logs.counters == {"/lorem": 2, "/dolor/sit": 1, "/key": 1}
+
+        server.access_logs = []
+        assert server.access_logs.total == 0
+        assert server.access_logs != ["/key"]
+
+
+@pytest.mark.parametrize("engine", ["threading", "asyncio"])
+def test_latency(engine):
+    with zebr0.TestServer({"key": "value", "slow": "value"}, engine=engine, latency=0.2, overrides={"slow": {"latency": {0.5: 1}}}) as server:
+        start = time.perf_counter()
+        assert requests.get("http://127.0.0.1:8000/key").text == "value"
+        assert 0.2 <= time.perf_counter() - start < 0.5
+
+        start = time.perf_counter()
+        assert requests.get("http://127.0.0.1:8000/slow").text == "value"
+        assert time.perf_counter() - start >= 0.5
+
+        server.latency = (0, 0.1)
+        start = time.perf_counter()
+        assert requests.get("http://127.0.0.1:8000/key").text == "value"
+        assert time.perf_counter() - start < 0.2
+
+
+@pytest.mark.parametrize("engine", ["threading", "asyncio"])
+def test_bandwidth(engine):
+    with zebr0.TestServer({"key": "x" * 1000}, engine=engine, bandwidth=4000):
+        start = time.perf_counter()
+        assert requests.get("http://127.0.0.1:8000/key").text == "x" * 1000
+        assert time.perf_counter() - start >= 0.2
+
+
+@pytest.mark.parametrize("engine", ["threading", "asyncio"])
+def test_errors(engine):
+    with zebr0.TestServer({"key": "value", "safe": "value"}, engine=engine, error_rate=1, errors=[503], overrides={"safe": {"error_rate": 0}}) as server:
+        assert requests.get("http://127.0.0.1:8000/key").status_code == 503
+        assert requests.get("http://127.0.0.1:8000/safe").text == "value"
+
+        server.errors = ["reset"]
+        with pytest.raises(requests.ConnectionError):
+            requests.get("http://127.0.0.1:8000/key")
+
+        server.errors = ["slow-headers"]
+        with pytest.raises(requests.ReadTimeout):
+            requests.get("http://127.0.0.1:8000/key", timeout=0.05)
+
+        time.sleep(0.1)
+        assert server.access_logs[:3] == ["/key", "/safe", "/key"]
+
+
+def test_asyncio_engine_pipelining_with_latency():
+    with zebr0.TestServer({"lorem": "ipsum", "dolor": "sit"}, engine="asyncio", overrides={"lorem": {"latency": 0.2}}) as server:
+        with socket.create_connection(("127.0.0.1", 8000)) as connection:
+            connection.sendall(b"GET /lorem HTTP/1.1\r\nHost: localhost\r\n\r\nGET /dolor HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+
+            responses = b""
+            while chunk := connection.recv(4096):
+                responses += chunk
+
+        assert responses.count(b"HTTP/1.1 200 OK") == 2
+        assert responses.index(b"ipsum") < responses.index(b"sit")  # the delayed response still comes first
+        assert server.access_logs == ["/lorem", "/dolor"]
@@ -1,98 +1,1164 @@
 from __future__ import annotations
 
 import argparse
-import http.server
+import codecs
+import collections
+import contextlib
+import contextvars
+import functools
+import gzip
+import hashlib
+import http
 import json
+import math
+import mmap
+import os
+import random
+import socket
+import stat
+import struct
+import sys
 import threading
+import time
+import urllib.parse
 from pathlib import Path
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Dict, Tuple, Iterator, Callable, Set, Union, BinaryIO, TYPE_CHECKING
 
-import jinja2
-import requests_cache
+if TYPE_CHECKING:  # the heavy dependencies are only imported on first use
+    import concurrent.futures
+    import http.server
+    import jinja2
+    import requests
+    import requests_cache
 
 ENCODING = "utf-8"
 
 URL = "url"
 LEVELS = "levels"
 CACHE = "cache"
+CACHE_FILE = "cache_file"
+SNAPSHOT_FILE = "snapshot_file"
+REPLICAS = "replicas"
+VALUES = "values"
+BUNDLE = "bundle"
+MANIFEST = "manifest"
+VERSION = "version"
+KEYS = "keys"
+LATENCY = "latency"
+BANDWIDTH = "bandwidth"
+ERROR_RATE = "error_rate"
+ERRORS = "errors"
+NETWORK = "network"
+TEMPLATING = "templating"
+READ = "read"
+TOTAL = "total"
 
 URL_DEFAULT = "https://hub.zebr0.io"
 LEVELS_DEFAULT = []
 CACHE_DEFAULT = 300
+WORKERS_DEFAULT = 8
+POOL_SIZE_DEFAULT = 8
+TIMEOUT_DEFAULT = 30
+REPLICA_COOLDOWN = 10  # in seconds, how long a failing replica is only used as a last resort
+HEDGE_SAMPLES = 100  # number of recent latencies the hedging delay is computed from
+HEDGE_MIN_SAMPLES = 10  # no hedging until that many latencies are known
+TEMPLATE_CACHE_DEFAULT = 128
+FILE_CACHE_SIZE_DEFAULT = 64 * 1024 * 1024
+MMAP_THRESHOLD_DEFAULT = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+WATCH_INTERVAL_DEFAULT = 10
+THREADING = "threading"
+ASYNCIO = "asyncio"
+RESET = "reset"
+SLOW_HEADERS = "slow-headers"
+SLOW_HEADERS_INTERVAL = 0.1  # delay between each byte of the headers, for the "slow-headers" fault
+BANDWIDTH_INTERVAL = 0.1  # a bandwidth-limited body is sent in chunks of this many seconds worth of bytes
+
+TEMPLATE_MARKERS = ["{{", "{%", "{#", "\r"]  # without these, jinja would render a value as is ("\r" because it normalizes the newlines)
 CONFIGURATION_FILE_DEFAULT = Path("/etc/zebr0.conf")
 
+ASYNC_MEMO = contextvars.ContextVar("ASYNC_MEMO", default=None)  # state of the top-level call of the current asyncio task, see AsyncClient._memo()
+TRACE = contextvars.ContextVar("TRACE", default=(None, None))  # (client, trace) of the current top-level call, also visible from the workers it submits requests to, see Client._trace()
+
+
+class _BaseClient:
+    """ Configuration, templating and inheritance mechanisms shared by the Client and the AsyncClient, see the Client for the details. """
+
+    def __init__(self, url: str, levels: Optional[List[str]], cache: int, configuration_file: Path, cache_file: Optional[Path], snapshot_file: Optional[Path],
+                 concurrent_probing: bool, template_cache: int, enable_async: bool = False, replicas: Optional[List[str]] = None) -> None:
+        # first set default values
+        self.url = URL_DEFAULT
+        self.levels = LEVELS_DEFAULT
+        self.cache = CACHE_DEFAULT
+        self.cache_file = None
+        self.snapshot_file = None
+        self.replicas = []
+
+        # then override with the configuration file if present
+        try:
+            configuration_string = configuration_file.read_text(ENCODING)
+            configuration = json.loads(configuration_string)
+
+            self.url = configuration.get(URL, URL_DEFAULT)
+            self.levels = configuration.get(LEVELS, LEVELS_DEFAULT)
+            self.cache = configuration.get(CACHE, CACHE_DEFAULT)
+            self.cache_file = Path(configuration[CACHE_FILE]) if configuration.get(CACHE_FILE) else None
+            self.snapshot_file = Path(configuration[SNAPSHOT_FILE]) if configuration.get(SNAPSHOT_FILE) else None
+            self.replicas = configuration.get(REPLICAS, [])
+        except OSError:
+            pass  # configuration file not found, ignored
+
+        # finally override with the parameters if present
+        if url:
+            self.url = url
+        if levels:
+            self.levels = levels
+        if cache:
+            self.cache = cache
+        if cache_file:
+            self.cache_file = cache_file
+        if snapshot_file:
+            self.snapshot_file = snapshot_file
+        if replicas:
+            self.replicas = replicas
+
+        # templating setup, the environment being created on first use (see jinja_environment) as many lookups don't need one
+        self.enable_async = enable_async
+        self._jinja_environment = None
+        self.compile_template = functools.lru_cache(maxsize=template_cache)(self._compile)  # see compile_template.cache_info() for hits and misses
+        self.setup_lock = threading.Lock()  # guards the creation of the objects created on first use
+
+        # lookups setup
+        self.concurrent_probing = concurrent_probing
+        self.resolved_levels = {}  # key -> (expiration time, depth of the deepest level that answered, or -1 if none did)
+        self.missing_urls = {}  # url -> expiration time, for the urls that answered 404
+        self.snapshot = None  # raw values from the snapshot file, loaded on first use
+
+    def _on_first_use(self, attribute: str, build: Callable[[], Any]) -> Any:
+        """ Returns the value of an attribute, built on first use, only once even if several threads need it at the same time. """
+
+        value = getattr(self, attribute)
+        if value is None:
+            with self.setup_lock:
+                value = getattr(self, attribute)
+                if value is None:  # another thread may have been faster
+                    value = build()
+                    setattr(self, attribute, value)
+        return value
+
+    @property
+    def jinja_environment(self) -> jinja2.Environment:
+        """ The environment of the templating engine, created on first use, see _build_jinja_environment(). """
+        return self._on_first_use("_jinja_environment", self._build_jinja_environment)
+
+    def _build_jinja_environment(self) -> jinja2.Environment:
+        """ Creates the environment of the templating engine, the "get" filter being up to the subclasses. """
+
+        import jinja2  # deferred, as importing it takes longer than many lookups
+
+        jinja_environment = jinja2.Environment(keep_trailing_newline=True, enable_async=self.enable_async)
+        jinja_environment.globals[URL] = self.url
+        jinja_environment.globals[LEVELS] = self.levels
+        jinja_environment.filters["read"] = jinja2.pass_context(lambda _, *args, **kwargs: read(*args, **kwargs))  # pass_context keeps jinja from evaluating the filters at compile time, as compiled templates are cached
+        return jinja_environment
+
+    def _compile(self, value: str) -> Tuple[jinja2.Template, List[str]]:
+        """ Compiles a template, and lists the keys it references through the constant arguments of the "get" filter. """
+
+        import jinja2
+
+        ast = self.jinja_environment.parse(value)
+        references = [node.node.value for node in ast.find_all(jinja2.nodes.Filter) if node.name == "get" and isinstance(node.node, jinja2.nodes.Const) and isinstance(node.node.value, str)]
+        return self.jinja_environment.from_string(ast), references
+
+    def _references(self, values: List[Optional[str]]) -> List[str]:
+        """ Lists the keys referenced by some raw values, for them to be prefetched. """
+
+        references = []
+        for value in values:
+            if value is not None and any(marker in value for marker in TEMPLATE_MARKERS):
+                import jinja2
+
+                try:
+                    references.extend(self.compile_template(value)[1])
+                except jinja2.TemplateSyntaxError:
+                    pass  # the value may not be meant to be rendered, the error will be raised later if it is
+        return references
+
+    def _urls(self, key: str, refresh: bool = False) -> List[Tuple[int, str]]:
+        """
+        Returns the candidate urls of a key with the depth of their level, from the deepest level to the root level.
+        Until the cache expires, only the level that last answered for this key is returned (none if the key was missing), and the urls known to be missing are skipped.
+
+        :param refresh: shall all the levels be returned, ignoring what is known ? defaults to False
+        """
+
+        now = time.monotonic()
+        urls = [(depth, "/".join([self.url] + self.levels[:depth] + [key])) for depth in range(len(self.levels), -1, -1)]
+        if refresh:
+            return urls
+
+        expiration, depth = self.resolved_levels.get(key, (0, len(self.levels)))
+        if expiration > now:
+            urls = [url for url in urls if url[0] <= depth]  # the parent levels are still there as a fallback
+
+        return [(depth, url) for depth, url in urls if self.missing_urls.get(url, 0) <= now]
+
+    def _snapshot(self) -> Dict[str, Optional[str]]:
+        """ Returns the raw values from the snapshot file, if it exists, is valid, and was compiled for the same url and levels. """
+        return self._on_first_use("snapshot", self._load_snapshot)  # the threads of the first lookups wait for it, rather than going to the network
+
+    def _load_snapshot(self) -> Dict[str, Optional[str]]:
+        """ Reads the snapshot file for _snapshot(), or returns an empty snapshot. """
+
+        if self.snapshot_file:
+            try:
+                snapshot = json.loads(self.snapshot_file.read_text(ENCODING))
+                if snapshot[URL] == self.url and snapshot[LEVELS] == self.levels and isinstance(snapshot[VALUES], dict):
+                    return snapshot[VALUES]
+            except OSError:
+                pass  # snapshot file not found, ignored
+            except (ValueError, KeyError, TypeError):
+                pass  # not a snapshot file (e.g. truncated), ignored as well
+        return {}
+
+    def _is_resolved(self, key: str) -> bool:
+        """ Tells whether the level that answers for a key is known, until the cache expires. """
+        return self.resolved_levels.get(key, (0, -1))[0] > time.monotonic()
+
+    def _resolved(self, key: str, depth: int, value: str) -> str:
+        """ Remembers the level that answered for a key until the cache expires, and returns the value. """
+
+        self.resolved_levels[key] = (time.monotonic() + self.cache, depth)
+        return value
+
+    def _not_found(self, key: str, urls: List[Tuple[int, str]]) -> None:
+        """ Remembers that a key isn't found at any level until the cache expires, unless a level failed for another reason than a 404, and returns None. """
+
+        if all(url in self.missing_urls for _, url in urls):
+            self.resolved_levels[key] = (time.monotonic() + self.cache, -1)
+        return None
+
+    def save_configuration(self, configuration_file: Path = CONFIGURATION_FILE_DEFAULT) -> None:
+        """
+        Saves the Client's configuration to a JSON file.
+
+        :param configuration_file: path to the configuration file, defaults to /etc/zebr0.conf for a system-wide configuration
+        """
+
+        configuration = {URL: self.url, LEVELS: self.levels, CACHE: self.cache}
+        if self.cache_file:
+            configuration[CACHE_FILE] = str(self.cache_file)
+        if self.snapshot_file:
+            configuration[SNAPSHOT_FILE] = str(self.snapshot_file)
+        if self.replicas:
+            configuration[REPLICAS] = self.replicas
+        configuration_string = json.dumps(configuration)
+        configuration_file.write_text(configuration_string, ENCODING)
+
+
+class Client(_BaseClient):
+    """
+    Nested key-value system with built-in inheritance and templating, designed for configuration management and deployment.
+
+    This Client can connect to any key-value server that follows HTTP REST standards.
+    For now it only supports plain text responses, JSON support is in the works.
+
+    Nested keys and inheritance:
+    To fully exploit the Client, you should define a structure in the naming of your keys, like "<project>/<environment/<key>".
+    Then use the "levels" parameter of the constructor to point to a specific project and environment, like ["mattermost", "production"].
+    Finally, use the get() function to fetch a key and it will automatically look for the most specific value possible.
+    Note that you don't have to duplicate keys for each project and environment, as they can be inherited from their parent level.
+
+    Templating:
+    You can use the double-braces {{  }} in your values to benefit from the Jinja templating engine.
+    You can refer to the constructor parameters {{ url }} and {{ levels[x] }}, include the value from another key {{ "another-key" | get }} or the content of a file {{ "/path/to/the/file" | read }}.
+    The keys referenced through the "get" filter are fetched concurrently before the rendering, and a reference cycle raises a ValueError.
+
+    Configuration file:
+    Client configuration can also be read from a JSON file, a simple dictionary with the "url", "levels", "cache" and optional "cache_file", "snapshot_file" and "replicas" keys.
+    The save_configuration() function can help you create one from an existing Client.
+    The suggested default path can be used for a system-wide configuration.
+    If provided, constructor parameters will always supersede the values from the configuration file, which in turn supersede the default values.
+
+    Note that the inheritance and templating mechanisms are performed by the client, to be as server-agnostic as possible.
+
+    Snapshot file:
+    The save_snapshot() function resolves a set of keys once and for all, and saves their raw values in a JSON file.
+    When a snapshot file is provided, the keys it contains are read from there first, without any http request.
+    This allows a fast startup, which doesn't depend on the server being available.
+
+    Thread safety:
+    A Client can be shared between threads.
+    Concurrent requests for the same url are coalesced, so that a single http request serves all the threads waiting for it.
+
+    Replicas:
+    Other servers with the same keys can be given as replicas of the main url.
+    When a server can't be reached, times out or answers with a 5xx status, the request fails over to the next one, and the failing server is only used as a last resort for a while.
+    With hedging, if a server hasn't answered within a given percentile of the recent latencies, the same request is also sent to the next server, and the first answer wins.
+    The values streamed by get_to_file() fail over the same way, but are never hedged.
+
+    Http sessions:
+    The Clients of a process share their http sessions, one per server url (see SessionRegistry), with its connections and its cache of http responses.
+    So creating a new Client is cheap, and the responses cached by one are reused by the others, whatever their levels.
+
+    Instrumentation:
+    Each top-level call (get(), get_many(), a poll of watch() or save_snapshot()) produces a trace, a dictionary with:
+    "keys" the keys asked for, "levels" the depth of the level that answered each of them (-1 if none did, absent if they came from the snapshot),
+    "probes" the number of http requests sent, "cache_hits" and "cache_misses" how many of them were answered by the cache or by the server,
+    the time spent in seconds: "network" waiting for the lookups, "templating" rendering the values, "read" reading files, and "total",
+    and "errors" the number of http requests answered with an error other than "not found", the level being then skipped as if the key were missing.
+    The hooks are called with each trace, and stats() returns the cumulated figures.
+    Note that the http requests still in flight at the end of a call (e.g. for the parent levels of a key found concurrently) are counted when they complete.
+
+    :param url: URL of the key-value server, defaults to https://hub.zebr0.io
+    :param levels: levels of specialization (e.g. ["mattermost", "production"] for a <project>/<environment>/<key> structure), defaults to []
+    :param cache: in seconds, the duration of the cache of http responses, defaults to 300 seconds
+    :param configuration_file: path to the configuration file, defaults to /etc/zebr0.conf for a system-wide configuration
+    :param cache_file: path to an SQLite file where to persist the cache of http responses, so that it can be shared between processes (expired responses are then revalidated with conditional requests), defaults to an in-memory cache
+    :param snapshot_file: path to a snapshot file created by save_snapshot(), from which the keys are read first, defaults to no snapshot
+    :param stale_while_revalidate: shall an expired value be returned immediately, while it's refreshed in the background ? defaults to False
+    :param use_manifest: shall the list of existing keys be downloaded from the server (see the manifest endpoint of the TestServer), so that the levels where a key doesn't exist are never requested ? defaults to False
+    :param concurrent_probing: shall all the levels be requested at once rather than one after the other ? defaults to False
+    :param workers: maximum number of concurrent http requests, defaults to 8
+    :param template_cache: maximum number of compiled templates kept in cache, defaults to 128
+    :param hooks: functions to call with the trace of each top-level call, see Instrumentation, defaults to none
+    :param session_registry: where to get the http session from, defaults to the process-wide SESSION_REGISTRY
+    :param replicas: URLs of other key-value servers with the same keys, to fail over to, defaults to none
+    :param hedge_percentile: percentile of the recent latencies (e.g. 0.95) after which a request is also sent to the next replica, defaults to no hedging
+    """
+
+    def __init__(self, url: str = "", levels: Optional[List[str]] = None, cache: int = 0, configuration_file: Path = CONFIGURATION_FILE_DEFAULT, cache_file: Optional[Path] = None,
+                 snapshot_file: Optional[Path] = None, stale_while_revalidate: bool = False, use_manifest: bool = False, concurrent_probing: bool = False, workers: int = WORKERS_DEFAULT, template_cache: int = TEMPLATE_CACHE_DEFAULT,
+                 hooks: List[Callable[[Dict[str, Any]], None]] = None, session_registry: Optional[SessionRegistry] = None, replicas: Optional[List[str]] = None, hedge_percentile: Optional[float] = None) -> None:
+        super().__init__(url, levels, cache, configuration_file, cache_file, snapshot_file, concurrent_probing, template_cache, replicas=replicas)
+
+        # templating setup
+        self.local = threading.local()  # state of the top-level call of the current thread
+
+        # http requests setup, the session and the workers being created on first use (see http_session) as the lookups may all be answered by the snapshot
+        self.session_registry = session_registry or SESSION_REGISTRY
+        self._http_session = None
+        self._executor = None
+        self.workers = workers
+        self.stale_while_revalidate = stale_while_revalidate
+        self.pending_requests = {}  # (url, refresh) -> future of the http request in flight
+        self.bundle = (0, {})  # (expiration time, raw values by path), see prefetch()
+        self.use_manifest = use_manifest
+        self.manifest = (0, None, None)  # (expiration time, version, paths of the existing keys)
+        self.lock = threading.Lock()  # guards the pending requests and the stale-while-revalidate refreshes
+
+        # replicas setup
+        self.hedge_percentile = hedge_percentile
+        self.failing_servers = {}  # server url -> time until which it's only used as a last resort
+        self.latencies = collections.deque(maxlen=HEDGE_SAMPLES)  # in seconds, of the recent http requests that weren't answered by the cache
+        self._hedge_executor = None
+
+        # instrumentation setup
+        self.hooks = hooks or []
+        self.cumulated_stats = {"lookups": 0, "probes": 0, "cache_hits": 0, "cache_misses": 0, NETWORK: 0.0, TEMPLATING: 0.0, READ: 0.0, TOTAL: 0.0, "errors": 0}
+        self.stats_lock = threading.Lock()  # guards the counters updated from the workers, and the cumulated stats
+
+    @property
+    def http_session(self) -> requests_cache.CachedSession:
+        """ The http session, with its cache of http responses, shared with the other Clients of the same server url, see SessionRegistry. """
+        return self._on_first_use("_http_session", lambda: self.session_registry.get(self.url, self.cache, self.cache_file, self.stale_while_revalidate))
+
+    @property
+    def executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """ The workers sending the concurrent http requests, created on first use. """
+
+        import concurrent.futures
+
+        return self._on_first_use("_executor", lambda: concurrent.futures.ThreadPoolExecutor(max_workers=self.workers))
+
+    @property
+    def hedge_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """ The workers sending the hedged http requests, apart from the others as they may be waited for by them. """
+
+        import concurrent.futures
+
+        return self._on_first_use("_hedge_executor", lambda: concurrent.futures.ThreadPoolExecutor(max_workers=self.workers * (1 + len(self.replicas))))
+
+    def _build_jinja_environment(self) -> jinja2.Environment:
+        """ Adds the "get" filter, and times the "read" filter. """
+
+        import jinja2
+
+        jinja_environment = super()._build_jinja_environment()
+        jinja_environment.filters["get"] = jinja2.pass_context(lambda _, *args, **kwargs: self.get(*args, **kwargs))  # pass_context keeps jinja from evaluating the filters at compile time, as compiled templates are cached
+        jinja_environment.filters["read"] = jinja2.pass_context(lambda _, *args, **kwargs: self._read(*args, **kwargs))
+        return jinja_environment
+
+    def get(self, key: str, default: str = "", template: bool = True, strip: bool = True) -> str:
+        """
+        Fetches the value of a provided key from the server.
+        Based on the levels defined in the Client, will return the first key found from the deepest level to the root level.
+        A default value can be provided to be returned if the key isn't found at any level.
+        With concurrent probing, all the levels are requested at once and the deepest answer is returned as soon as it is known.
+
+        :param key: key to look for
+        :param default: value to return if the key isn't found at any level, defaults to ""
+        :param template: shall the value be processed by the templating engine ? defaults to True
+        :param strip: shall the value be stripped off leading and trailing white spaces ? defaults to True
+        :return: the resulting value of the key
+        """
+
+        with self._memo([key]):
+            values, stack = self.local.values, self.local.stack
+
+            if template and key in stack:
+                raise ValueError("reference cycle: " + " -> ".join(stack[stack.index(key):] + [key]))
+
+            if key not in values:
+                with self._timed(NETWORK):
+                    values[key] = self._fetch(key, self.local.refresh)
+            value = values[key]
+
+            if stack:  # nested call, already timed by the top-level rendering
+                stack.append(key)
+                try:
+                    return self._render(default if value is None else value, template, strip)
+                finally:
+                    stack.pop()
+
+            trace = self._trace()
+            before = trace[NETWORK] + trace[READ]
+            start = time.perf_counter()
+            stack.append(key)
+            try:
+                return self._render(default if value is None else value, template, strip)
+            finally:
+                stack.pop()
+                trace[TEMPLATING] += time.perf_counter() - start - (trace[NETWORK] + trace[READ] - before)  # the lookups and file reads of the rendering aren't templating
+
+    def get_many(self, keys: List[str], default: str = "", template: bool = True, strip: bool = True) -> Dict[str, str]:
+        """
+        Fetches the values of several keys at once, with the same semantics as get().
+        The candidate urls of all the keys are requested concurrently, and only once even if several keys share them.
+
+        :param keys: keys to look for
+        :param default: value to return for a key that isn't found at any level, defaults to ""
+        :param template: shall the values be processed by the templating engine ? defaults to True
+        :param strip: shall the values be stripped off leading and trailing white spaces ? defaults to True
+        :return: the resulting values, by key
+        """
+
+        with self._memo(keys):
+            with self._timed(NETWORK):
+                self.local.values.update(self._fetch_many(keys, self.local.refresh))
+            return {key: self.get(key, default, template, strip) for key in keys}
+
+    def get_to_file(self, key: str, file: Union[Path, BinaryIO], default: str = "", template: bool = True, strip: bool = True) -> None:
+        """
+        Same as get(), but writes the resulting value to a file in chunks, so that a large value never has to fit in memory.
+        Without templating, the value is streamed from the server and bypasses the cache of http responses.
+        With templating, the raw value is fetched as usual, but its rendering is written as it's generated.
+        A file given by its path is replaced atomically once the whole value is written, and left untouched if anything fails.
+
+        :param key: key to look for
+        :param file: path to the file, or binary file object, where to write the value (encoded in utf-8, or as is without templating nor stripping)
+        :param default: value to write if the key isn't found at any level, defaults to ""
+        :param template: shall the value be processed by the templating engine ? defaults to True
+        :param strip: shall the value be stripped off leading and trailing white spaces ? defaults to True
+        """
+
+        if isinstance(file, (str, Path)):
+            with self._atomic_file(Path(file)) as file_object:
+                return self.get_to_file(key, file_object, default, template, strip)
+
+        with self._memo([key]):
+            if template:
+                chunks = self._generate(key, default)
+            else:
+                chunks = self._stream(key)
+                if chunks is None:
+                    chunks = [default]  # text, as the writing encodes it anyway
+                elif strip:
+                    chunks = self._decode(chunks, ENCODING)
+
+            if strip:
+                chunks = self._strip(chunks)
+            for chunk in chunks:
+                file.write(chunk.encode(ENCODING) if isinstance(chunk, str) else chunk)
+
+    def render_to_files(self, manifest: Dict[str, Path], default: Optional[str] = None, template: bool = True, strip: bool = True) -> Dict[str, bool]:
+        """
+        Renders several keys at once to files, with the same semantics as get_many().
+        The files are written concurrently by the workers, each one atomically (so that readers never see a partial file) and only if its content changed.
+        No file is written at all if the server answered any request with an error (see Instrumentation), or if a key isn't found and there's no default value.
+
+        :param manifest: path of the file where to write the resulting value, by key
+        :param default: value to write for a key that isn't found at any level, defaults to none, the key being then an error
+        :param template: shall the values be processed by the templating engine ? defaults to True
+        :param strip: shall the values be stripped off leading and trailing white spaces ? defaults to True
+        :return: whether the file was written, by key (False if it was already up to date)
+        """
+
+        import requests
+
+        with self._memo(list(manifest)):
+            values = self.get_many(list(manifest), "" if default is None else default, template, strip)
+
+            if self._trace()["errors"]:
+                raise requests.HTTPError("the server answered some requests with an error, no file was written")
+            missing = [key for key in manifest if self.local.values[key] is None]
+            if default is None and missing:
+                raise LookupError("keys not found, no file was written: " + ", ".join(missing))
+
+        written = self.executor.map(self._write_if_changed, [Path(path) for path in manifest.values()], [value.encode(ENCODING) for value in values.values()])
+        return dict(zip(manifest, written))
+
+    def _write_if_changed(self, path: Path, content: bytes) -> bool:
+        """ Atomically replaces a file with the given content, unless it already has it. """
+
+        try:
+            if path.stat().st_size == len(content) and path.read_bytes() == content:
+                return False
+        except FileNotFoundError:
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._atomic_file(path) as file:
+            file.write(content)
+        return True
+
+    @contextlib.contextmanager
+    def _atomic_file(self, path: Path) -> Iterator[BinaryIO]:
+        """
+        Opens a temporary file next to the given path, that replaces it at the end of the block, so that readers never see a partial file.
+        The temporary file gets a unique name, the permissions of the file it replaces if any, and is removed if the block fails.
+        A symbolic link is kept, the file it points to being replaced instead (e.g. /etc/resolv.conf).
+        """
+
+        import tempfile
+
+        path = path.resolve()  # so that the temporary file is on the file system of the actual file
+        try:
+            mode = stat.S_IMODE(path.stat().st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~self._umask()  # as for a file created the usual way
+
+        descriptor, temporary_file = tempfile.mkstemp(prefix=path.name + ".", suffix=".tmp", dir=path.parent)
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                yield file
+            os.chmod(temporary_file, mode)
+            os.replace(temporary_file, path)
+        except BaseException:
+            os.remove(temporary_file)
+            raise
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _umask() -> int:
+        """ Returns the umask of the process, read only once as it can only be read by setting it. """
+
+        umask = os.umask(0o022)
+        os.umask(umask)
+        return umask
+
+    def watch(self, keys: List[str], callback: Callable[[str, str], None], interval: float = WATCH_INTERVAL_DEFAULT, default: str = "", template: bool = True, strip: bool = True) -> threading.Event:
+        """
+        Watches several keys for changes, in a separate thread.
+        The keys are polled with conditional requests, so that unchanged values are not downloaded again.
+        Only the level that answered for a key and the deeper ones are polled, the parent levels being requested only if that level doesn't answer anymore.
+        The callback is only called when the resulting value of a key (with the same semantics as get()) differs from the previous poll.
+        The errors of a poll (e.g. an unreachable server or a faulty template) and of the callback are logged through the "zebr0" logger, and the watching goes on.
+
+        :param keys: keys to watch
+        :param callback: function to call with the key and its new value when it changes
+        :param interval: in seconds, the duration between two polls, defaults to 10 seconds
+        :param default: value to use for a key that isn't found at any level, defaults to ""
+        :param template: shall the values be processed by the templating engine ? defaults to True
+        :param strip: shall the values be stripped off leading and trailing white spaces ? defaults to True
+        :return: an Event, to be set to stop watching
+        """
+
+        def poll():
+            with self._memo(keys, refresh=True):
+                return self.get_many(keys, default, template, strip)
+
+        stopped = threading.Event()
+        values = poll()  # the current values are known when this function returns, so that no change can be missed
+
+        def loop():
+            import logging
+            import requests
+
+            logger = logging.getLogger(__name__)
+            while not stopped.wait(interval):
+                try:
+                    new_values = poll()
+                except requests.RequestException as exception:
+                    logger.warning("watch: server unreachable, trying again later: %s", exception)
+                    continue
+                except Exception:
+                    logger.exception("watch: poll of %s failed, trying again later", keys)
+                    continue  # e.g. a template error, that may be fixed on the server in the meantime
+
+                for key, value in new_values.items():
+                    if value != values[key]:
+                        values[key] = value
+                        try:
+                            callback(key, value)
+                        except Exception:
+                            logger.exception("watch: callback failed for %s", key)
+
+        threading.Thread(target=loop, daemon=True).start()
+        return stopped
+
+    def prefetch(self) -> bool:
+        """
+        Loads all the keys under the levels of the Client in a single http request, if the server supports it (see the bulk endpoint of the TestServer).
+        Until the cache expires, the lookups are then answered locally, including for the missing keys.
+        If the server doesn't support it, the lookups just keep on requesting the keys one by one.
+
+        :return: True if the keys could be loaded, False otherwise
+        """
+
+        prefixes = ["/".join(self.levels[:depth]) for depth in range(len(self.levels) + 1)]
+        response = self._http_get(self.url + "/", params={BUNDLE: prefixes})
+
+        try:
+            bundle = response.json() if response.ok else None
+        except ValueError:
+            bundle = None  # not a bundle, whatever the server is
+        if not isinstance(bundle, dict):
+            return False
+
+        self.bundle = (time.monotonic() + self.cache, bundle)
+        return True
+
+    def save_snapshot(self, keys: List[str], snapshot_file: Optional[Path] = None) -> None:
+        """
+        Resolves several keys, along with the keys they reference through the "get" filter, and saves their raw values in a snapshot file.
+        The values are revalidated with the server rather than read from the cache or from a previous snapshot.
+
+        :param keys: keys to resolve
+        :param snapshot_file: path to the snapshot file, defaults to the one of the Client
+        """
+
+        snapshot_file = snapshot_file or self.snapshot_file
+        if not snapshot_file:
+            raise ValueError("no snapshot file, neither given nor configured in the Client")
+
+        with self._memo(keys, refresh=True):
+            self._prefetch(keys)
+            snapshot = {URL: self.url, LEVELS: self.levels, VALUES: self.local.values}
+            snapshot_string = json.dumps(snapshot)
+
+        with self._atomic_file(snapshot_file) as file:  # so that concurrent readers never see a partial snapshot
+            file.write(snapshot_string.encode(ENCODING))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the figures of all the top-level calls so far, see Instrumentation.
+
+        :return: the number of top-level calls under "lookups", and the sums of the numeric figures of their traces
+        """
+
+        with self.stats_lock:
+            return dict(self.cumulated_stats)
+
+    @contextlib.contextmanager
+    def _memo(self, keys: List[str], refresh: bool = False) -> Iterator[None]:
+        """
+        Memoizes the raw values of the resolved keys, and the keys being rendered, for the length of a top-level call.
+        With refresh, all the keys resolved during the call are revalidated with the server rather than read from the cache.
+        The top-level call is traced, see Instrumentation.
+        """
+
+        if hasattr(self.local, "values"):  # nested call, from the "get" filter of a template being rendered
+            yield
+            return
+
+        trace = {KEYS: keys, LEVELS: {}, "probes": 0, "cache_hits": 0, "cache_misses": 0, NETWORK: 0.0, TEMPLATING: 0.0, READ: 0.0, TOTAL: 0.0, "errors": 0}
+        token = TRACE.set((self, trace))
+        start = time.perf_counter()
+
+        self.local.values, self.local.stack, self.local.refresh = {}, [], refresh
+        try:
+            yield
+        finally:
+            del self.local.values, self.local.stack, self.local.refresh
+            trace[TOTAL] = time.perf_counter() - start
+            TRACE.reset(token)
+
+            with self.stats_lock:
+                self.cumulated_stats["lookups"] += 1
+                for name in NETWORK, TEMPLATING, READ, TOTAL:
+                    self.cumulated_stats[name] += trace[name]
+
+        for hook in self.hooks:
+            hook(trace)
+
+    def _trace(self) -> Optional[Dict[str, Any]]:
+        """ Returns the trace of the current top-level call, if it's one of this Client. """
+
+        client, trace = TRACE.get()
+        return trace if client is self else None
+
+    @contextlib.contextmanager
+    def _timed(self, category: str) -> Iterator[None]:
+        """ Adds the duration of a block to a category of the current trace (only from the thread of the top-level call). """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            trace = self._trace()
+            if trace is not None:
+                trace[category] += time.perf_counter() - start
+
+    def _read(self, path: str, encoding: str = ENCODING) -> str:
+        """ The "read" filter, timed. """
+
+        with self._timed(READ):
+            return read(path, encoding)
+
+    def _submit(self, function: Callable, *args: Any) -> concurrent.futures.Future:
+        """ Submits a function to the workers, within the context of the caller, so that its trace is still the current one. """
+        return self.executor.submit(contextvars.copy_context().run, function, *args)
+
+    def _generate(self, key: str, default: str) -> Iterator[str]:
+        """ Same as get(), but yields the rendering of the value as jinja generates it. """
+
+        values, stack = self.local.values, self.local.stack
+
+        if key in stack:
+            raise ValueError("reference cycle: " + " -> ".join(stack[stack.index(key):] + [key]))
+
+        if key not in values:
+            with self._timed(NETWORK):
+                values[key] = self._fetch(key, self.local.refresh)
+        value = default if values[key] is None else values[key]
+
+        if not any(marker in value for marker in TEMPLATE_MARKERS):
+            yield value
+            return
+
+        compiled_template, references = self.compile_template(value)
+        self._prefetch(references)
+        stack.append(key)
+        try:
+            yield from compiled_template.generate()
+        finally:
+            stack.pop()
+
+    def _stream(self, key: str) -> Optional[Iterator[bytes]]:
+        """ Same as _fetch(), but returns the raw value in chunks of bytes, streamed from the server unless it's in the snapshot or in the bundle. """
+
+        snapshot = self._snapshot()
+        if key in snapshot:
+            return None if snapshot[key] is None else iter([snapshot[key].encode(ENCODING)])
+
+        urls = self._urls(key)
+        for depth, url in urls:
+            expiration, bundle = self.bundle
+            if expiration > time.monotonic():
+                value = bundle.get(url[len(self.url) + 1:])
+                if value is not None:
+                    return iter([self._resolved(key, depth, value).encode(ENCODING)])
+                continue
+
+            response = self._failover(url, self._http_stream, hedge=False)  # not hedged, as a streamed response holds its connection until it's read
+            if response.ok:
+                self._resolved(key, depth, "")  # only the level matters here
+
+                def chunks():
+                    with response:  # gives the connection back to the pool, even if the writing fails
+                        yield from response.iter_content(CHUNK_SIZE)
+
+                return chunks()
+
+            response.close()
+            if response.status_code == 404:
+                self.missing_urls[url] = time.monotonic() + self.cache
+        return self._not_found(key, urls)
+
+    @staticmethod
+    def _decode(chunks: Iterator[bytes], encoding: str) -> Iterator[str]:
+        """ Decodes a value given in chunks of bytes, even if a character spans two chunks. """
+
+        decoder = codecs.getincrementaldecoder(encoding)()
+        for chunk in chunks:
+            yield decoder.decode(chunk)
+        yield decoder.decode(b"", final=True)
+
+    @staticmethod
+    def _strip(chunks: Iterator[str]) -> Iterator[str]:
+        """ Strips a value given in chunks off its leading and trailing white spaces, holding back only the white spaces that may be trailing. """
+
+        leading, pending = True, ""
+        for chunk in chunks:
+            if leading:
+                chunk = chunk.lstrip()
+                leading = not chunk
+
+            stripped = chunk.rstrip()
+            if stripped:
+                if pending:
+                    yield pending
+                yield stripped
+                pending = chunk[len(stripped):]
+            else:
+                pending += chunk
+
+    def _prefetch(self, references: List[str]) -> None:
+        """ Fetches concurrently the referenced keys that haven't been resolved yet, then their own references, and so on. """
+
+        values = self.local.values
+        keys = [key for key in dict.fromkeys(references) if key not in values]
+        while keys:
+            with self._timed(NETWORK):
+                values.update(self._fetch_many(keys, self.local.refresh))
+            references = self._references([values[key] for key in keys])
+            keys = [key for key in dict.fromkeys(references) if key not in values]
+
+    def _render(self, value: str, template: bool, strip: bool) -> str:
+        """ Processes a raw value through the templating engine and the stripping, if asked to. """
+
+        if template and any(marker in value for marker in TEMPLATE_MARKERS):
+            compiled_template, references = self.compile_template(value)
+            self._prefetch(references)
+            value = compiled_template.render()  # templating
+        value = value.strip() if strip else value  # stripping
+
+        return value
+
+    def _urls(self, key: str, refresh: bool = False) -> List[Tuple[int, str]]:
+        """
+        In stale-while-revalidate mode, an expired answer is still used while a full lookup refreshes it in the background.
+        With the manifest, the levels where the key doesn't exist are skipped.
+        """
+
+        if self.stale_while_revalidate and not refresh:
+            with self.lock:
+                expiration, depth = self.resolved_levels.get(key, (math.inf, 0))
+                if expiration <= time.monotonic():
+                    self.resolved_levels[key] = (time.monotonic() + self.cache, depth)  # the stale answer is used until the refresh is over
+                    threading.Thread(target=self._fetch, args=(key, True), daemon=True).start()
+
+        urls = super()._urls(key, refresh)
+
+        paths = self._manifest() if self.use_manifest and not refresh else None
+        if paths is not None:
+            urls = [(depth, url) for depth, url in urls if url[len(self.url) + 1:] in paths]  # the other levels are sure to answer 404
+
+        return urls
+
+    def _manifest(self) -> Optional[Set[str]]:
+        """ Returns the paths of all the existing keys from the manifest of the server, refreshed when the cache expires, or None if the server doesn't provide one. """
+
+        expiration, version, paths = self.manifest
+        if expiration <= time.monotonic():
+            response = self._http_get(self.url + "/", params={MANIFEST: ""})  # revalidated with a conditional request once expired
+
+            try:
+                manifest = response.json() if response.ok else {}
+            except ValueError:
+                manifest = {}  # not a manifest, whatever the server is
+            if not isinstance(manifest, dict):
+                manifest = {}  # valid JSON, but not a manifest either
+
+            if manifest.get(VERSION) != version or paths is None:
+                version, paths = manifest.get(VERSION), set(manifest[KEYS]) if KEYS in manifest else None
+            self.manifest = (time.monotonic() + self.cache, version, paths)
+
+        return paths
+
+    def _request(self, url: str, refresh: bool = False) -> Optional[str]:
+        """
+        Returns the value at the given url, or None if it's missing, in which case the url is remembered as such until the cache expires.
+        Concurrent calls for the same url share a single http request.
+        """
+
+        import concurrent.futures
+
+        expiration, bundle = self.bundle
+        if not refresh and expiration > time.monotonic():
+            return bundle.get(url[len(self.url) + 1:])  # the bundle holds all the keys, so a key that isn't there is missing
+
+        with self.lock:
+            if not refresh and self.missing_urls.get(url, 0) > time.monotonic():
+                return None  # known to be missing since the candidate urls were computed
+
+            future = self.pending_requests.get((url, refresh))
+            if future:
+                leader = False
+            else:
+                leader, future = True, concurrent.futures.Future()
+                self.pending_requests[(url, refresh)] = future
+
+        if not leader:
+            return future.result()  # another thread is already on it
+
+        try:
+            value = self._send(url, refresh)
+            future.set_result(value)
+            return value
+        except BaseException as exception:
+            future.set_exception(exception)
+            raise
+        finally:
+            with self.lock:
+                del self.pending_requests[(url, refresh)]
+
+    def _http_get(self, url: str, **kwargs: Any) -> requests.Response:
+        """
+        Sends a GET request through the shared http session, with the cache duration of this Client and the timeout of the registry.
+        The request fails over to the replicas, and may be hedged, see Replicas.
+        """
+
+        return self._failover(url, lambda server_url: self._http_get_from(server_url, kwargs))
+
+    def _failover(self, url: str, send: Callable[[str], requests.Response], hedge: bool = True) -> requests.Response:
+        """
+        Sends a request to the main server, then to the replicas until one of them answers without a server error, see Replicas.
+
+        :param url: url of the request on the main server
+        :param send: function sending the request to a given url
+        :param hedge: may the request be hedged ? defaults to True
+        :return: the first response without a server error, or else the last one
+        """
+
+        if not self.replicas:
+            return send(url)
+
+        import concurrent.futures
+        import requests
+
+        now = time.monotonic()
+        servers = [self.url] + self.replicas
+        servers.sort(key=lambda server: max(self.failing_servers.get(server, 0), now))  # stable, so the failing ones come last, in the configured order otherwise
+        delay = self._hedge_delay() if hedge else None
+
+        def submit(server):
+            if delay is not None:
+                return self.hedge_executor.submit(send, server + url[len(self.url):])
+
+            future = concurrent.futures.Future()  # without hedging, the servers are requested one after the other from this very thread
+            try:
+                future.set_result(send(server + url[len(self.url):]))
+            except BaseException as exception:
+                future.set_exception(exception)
+            return future
+
+        futures, outcome = {}, None
+        while servers or futures:
+            if servers and (not futures or delay is not None):  # the next server is requested after a failure, or when the requests in flight are late
+                server = servers.pop(0)
+                futures[submit(server)] = server
+
+            done, _ = concurrent.futures.wait(futures, timeout=delay if servers else None, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                server = futures.pop(future)
+                try:
+                    outcome = future.result()
+                except (requests.ConnectionError, requests.Timeout) as exception:
+                    outcome = exception
+                if isinstance(outcome, Exception) or outcome.status_code >= 500:
+                    self.failing_servers[server] = time.monotonic() + REPLICA_COOLDOWN
+                    if not isinstance(outcome, Exception) and servers:
+                        outcome.close()  # gives the connection of a streamed response back to the pool
+                    continue
+
+                self.failing_servers.pop(server, None)
+                return outcome  # the requests still in flight are left to complete, as they may feed the cache
+
+        if isinstance(outcome, Exception):
+            raise outcome  # all the servers failed
+        return outcome
+
+    def _http_get_from(self, url: str, kwargs: Dict[str, Any]) -> requests.Response:
+        """ Actually sends a GET request for _http_get(), and records its latency if it wasn't answered by the cache. """
+
+        start = time.perf_counter()
+        response = self.http_session.get(url, expire_after=self.cache, timeout=self.session_registry.timeout, **kwargs)
+        if not getattr(response, "from_cache", False):
+            self.latencies.append(time.perf_counter() - start)
+        return response
+
+    def _http_stream(self, url: str) -> requests.Response:
+        """ Sends a GET request through the connections of the shared http session, but not its cache, as it would load the whole body. """
+
+        import requests
+
+        request = self.http_session.prepare_request(requests.Request("GET", url))
+        return requests.Session.send(self.http_session, request, stream=True, timeout=self.session_registry.timeout)
+
+    def _hedge_delay(self) -> Optional[float]:
+        """ Returns how long to wait for a server before sending the same request to the next one, or None if the requests aren't hedged. """
+
+        if self.hedge_percentile is None or len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+
+        latencies = sorted(self.latencies)
+        return latencies[int(self.hedge_percentile * (len(latencies) - 1))]
+
+    def _send(self, url: str, refresh: bool) -> Optional[str]:
+        """ Actually sends the http request for _request(). """
+
+        response = self._http_get(url, refresh=refresh)
+
+        trace = self._trace()
+        if trace is not None:
+            cache_status = "cache_hits" if getattr(response, "from_cache", False) else "cache_misses"
+            with self.stats_lock:  # directly in the cumulated stats too, as the request may complete after the end of its top-level call
+                for counters in trace, self.cumulated_stats:
+                    counters["probes"] += 1
+                    counters[cache_status] += 1
+
+        if response.ok:
+            return response.text
+        if response.status_code == 404:
+            self.missing_urls[url] = time.monotonic() + self.cache
+        elif trace is not None:
+            with self.stats_lock:
+                for counters in trace, self.cumulated_stats:
+                    counters["errors"] += 1
+        return None
+
+    def _resolved(self, key: str, depth: int, value: str) -> str:
+        """ Also records the level that answered in the current trace. """
+
+        trace = self._trace()
+        if trace is not None and key in trace[KEYS]:
+            trace[LEVELS][key] = depth
+        return super()._resolved(key, depth, value)
+
+    def _not_found(self, key: str, urls: List[Tuple[int, str]]) -> None:
+        """ Also records in the current trace that no level answered. """
+
+        trace = self._trace()
+        if trace is not None and key in trace[KEYS]:
+            trace[LEVELS][key] = -1
+        return super()._not_found(key, urls)
 
-class Client:
-    """
-    Nested key-value system with built-in inheritance and templating, designed for configuration management and deployment.
+    def _fetch(self, key: str, refresh: bool = False) -> Optional[str]:
+        """
+        Returns the raw value of a key from the deepest level where it is found, or None if it isn't found at any level.
 
-    This Client can connect to any key-value server that follows HTTP REST standards.
-    For now it only supports plain text responses, JSON support is in the works.
+        :param refresh: shall all the levels be revalidated with the server, ignoring what is known, cached or in the snapshot ? defaults to False
+        """
 
-    Nested keys and inheritance:
-    To fully exploit the Client, you should define a structure in the naming of your keys, like "<project>/<environment/<key>".
-    Then use the "levels" parameter of the constructor to point to a specific project and environment, like ["mattermost", "production"].
-    Finally, use the get() function to fetch a key and it will automatically look for the most specific value possible.
-    Note that you don't have to duplicate keys for each project and environment, as they can be inherited from their parent level.
+        snapshot = {} if refresh else self._snapshot()
+        if key in snapshot:
+            return snapshot[key]
 
-    Templating:
-    You can use the double-braces {{  }} in your values to benefit from the Jinja templating engine.
-    You can refer to the constructor parameters {{ url }} and {{ levels[x] }}, include the value from another key {{ "another-key" | get }} or the content of a file {{ "/path/to/the/file" | read }}.
+        urls = self._urls(key, refresh)
 
-    Configuration file:
-    Client configuration can also be read from a JSON file, a simple dictionary with the "url", "levels" and "cache" keys.
-    The save_configuration() function can help you create one from an existing Client.
-    The suggested default path can be used for a system-wide configuration.
-    If provided, constructor parameters will always supersede the values from the configuration file, which in turn supersede the default values.
+        if not self.concurrent_probing:
+            for depth, url in urls:
+                value = self._request(url, refresh)
+                if value is not None:
+                    return self._resolved(key, depth, value)  # if the key is found, we return the value, if not we try at the parent level
+            return self._not_found(key, urls)
+
+        # all the levels are requested at once, but a deeper level always takes precedence over its parents
+        futures = [(depth, self._submit(self._request, url, refresh)) for depth, url in urls]
+        try:
+            for depth, future in futures:
+                value = future.result()
+                if value is not None:
+                    return self._resolved(key, depth, value)  # all the deeper levels have failed, this answer wins
+            return self._not_found(key, urls)
+        finally:
+            for _, future in futures:
+                future.cancel()  # the remaining requests are useless, if they haven't started yet
+
+    def _fetch_many(self, keys: List[str], refresh: bool = False) -> Dict[str, Optional[str]]:
+        """
+        Same as _fetch() for several keys, with all the candidate urls requested at once (only the level known to answer, if any).
+        With refresh, the level known to answer and the deeper ones are requested at once, the parent levels only if needed.
+        """
+
+        snapshot = {} if refresh else self._snapshot()
+        values = {key: snapshot[key] for key in keys if key in snapshot}
+        keys = [key for key in keys if key not in snapshot]
+
+        urls = {key: self._urls(key, refresh) for key in keys}
+
+        futures = {}
+
+        def request(url):
+            if url not in futures:  # urls shared by several keys are only requested once
+                futures[url] = self._submit(self._request, url, refresh)
+            return futures[url]
+
+        for key in keys:
+            if not self._is_resolved(key):
+                first_urls = urls[key]
+            elif refresh:
+                first_urls = [(depth, url) for depth, url in urls[key] if depth >= self.resolved_levels[key][1]]  # the key may now be defined at a deeper level
+            else:
+                first_urls = urls[key][:1]
+            for _, url in first_urls:
+                request(url)
+
+        for key in keys:
+            for depth, url in urls[key]:
+                value = request(url).result()
+                if value is not None:
+                    values[key] = self._resolved(key, depth, value)
+                    break
+            else:
+                values[key] = self._not_found(key, urls[key])
+        return values
 
-    Note that the inheritance and templating mechanisms are performed by the client, to be as server-agnostic as possible.
+
+class AsyncClient(_BaseClient):
+    """
+    Same as the Client, for asyncio applications: get() and get_many() are coroutines, and the http requests are non-blocking.
+    It requires the aiohttp package.
+
+    Basic usage:
+
+    >>> async with AsyncClient() as client:
+    >>>     value = await client.get("key")
+
+    The http responses are cached in memory for the duration of the cache, and concurrent requests for the same url share a single http request.
+    The connections are pooled, so that any number of concurrent lookups can share the same event loop.
+    Each http request is bounded by the timeout of the SESSION_REGISTRY.
+
+    The configuration file is read as for the Client, but its "cache_file" and "replicas" keys are ignored:
+    the http responses are never persisted, and the http requests only go to the main url.
 
     :param url: URL of the key-value server, defaults to https://hub.zebr0.io
     :param levels: levels of specialization (e.g. ["mattermost", "production"] for a <project>/<environment>/<key> structure), defaults to []
     :param cache: in seconds, the duration of the cache of http responses, defaults to 300 seconds
     :param configuration_file: path to the configuration file, defaults to /etc/zebr0.conf for a system-wide configuration
+    :param snapshot_file: path to a snapshot file created by Client.save_snapshot(), from which the keys are read first, defaults to no snapshot
+    :param concurrent_probing: shall all the levels be requested at once rather than one after the other ? defaults to False
+    :param workers: maximum number of concurrent http connections, defaults to 8
+    :param template_cache: maximum number of compiled templates kept in cache, defaults to 128
     """
 
-    def __init__(self, url: str = "", levels: Optional[List[str]] = None, cache: int = 0, configuration_file: Path = CONFIGURATION_FILE_DEFAULT) -> None:
-        # first set default values
-        self.url = URL_DEFAULT
-        self.levels = LEVELS_DEFAULT
-        self.cache = CACHE_DEFAULT
+    def __init__(self, url: str = "", levels: Optional[List[str]] = None, cache: int = 0, configuration_file: Path = CONFIGURATION_FILE_DEFAULT, snapshot_file: Optional[Path] = None,
+                 concurrent_probing: bool = False, workers: int = WORKERS_DEFAULT, template_cache: int = TEMPLATE_CACHE_DEFAULT) -> None:
+        super().__init__(url, levels, cache, configuration_file, None, snapshot_file, concurrent_probing, template_cache, enable_async=True)
 
-        # then override with the configuration file if present
-        try:
-            configuration_string = configuration_file.read_text(ENCODING)
-            configuration = json.loads(configuration_string)
+        # http requests setup
+        self.workers = workers
+        self.http_session = None  # created on first use, as it requires a running event loop
+        self.responses = {}  # url -> (expiration time, value)
+        self.pending_requests = {}  # url -> task of the http request in flight
 
-            self.url = configuration.get(URL, URL_DEFAULT)
-            self.levels = configuration.get(LEVELS, LEVELS_DEFAULT)
-            self.cache = configuration.get(CACHE, CACHE_DEFAULT)
-        except OSError:
-            pass  # configuration file not found, ignored
+    def _build_jinja_environment(self) -> jinja2.Environment:
+        """ Adds the "get" filter, that jinja awaits in async mode. """
 
-        # finally override with the parameters if present
-        if url:
-            self.url = url
-        if levels:
-            self.levels = levels
-        if cache:
-            self.cache = cache
+        import jinja2
 
-        # templating setup
-        self.jinja_environment = jinja2.Environment(keep_trailing_newline=True)
-        self.jinja_environment.globals[URL] = self.url
-        self.jinja_environment.globals[LEVELS] = self.levels
-        self.jinja_environment.filters["get"] = self.get
-        self.jinja_environment.filters["read"] = read
+        async def get(_, *args, **kwargs):
+            return await self.get(*args, **kwargs)
 
-        # http requests setup
-        self.http_session = requests_cache.CachedSession(backend="memory", expire_after=cache)
+        jinja_environment = super()._build_jinja_environment()
+        jinja_environment.filters["get"] = jinja2.pass_context(get)
+        return jinja_environment
 
-    def get(self, key: str, default: str = "", template: bool = True, strip: bool = True) -> str:
+    async def get(self, key: str, default: str = "", template: bool = True, strip: bool = True) -> str:
         """
-        Fetches the value of a provided key from the server.
-        Based on the levels defined in the Client, will return the first key found from the deepest level to the root level.
-        A default value can be provided to be returned if the key isn't found at any level.
+        Same as Client.get(), but non-blocking.
 
         :param key: key to look for
         :param default: value to return if the key isn't found at any level, defaults to ""
@@ -101,42 +1167,343 @@ class Client:
         :return: the resulting value of the key
         """
 
-        # let's do this with a nice recursive function :)
-        def fetch(levels):
-            full_url = "/".join([self.url] + levels + [key])
-            response = self.http_session.get(full_url)
+        with self._memo() as (values, stack):
+            if template and key in stack:
+                raise ValueError("reference cycle: " + " -> ".join(stack[stack.index(key):] + [key]))
 
-            if response.ok:
-                return response.text  # if the key is found, we return the value
-            elif levels:
-                return fetch(levels[:-1])  # if not, we try at the parent level
-            else:
-                return default  # if we're at the top level, the key just doesn't exist, we return the default value
+            if key not in values:
+                values[key] = await self._fetch(key)
+            value = values[key]
+
+            stack.append(key)
+            try:
+                return await self._render(default if value is None else value, template, strip)
+            finally:
+                stack.pop()
+
+    async def get_many(self, keys: List[str], default: str = "", template: bool = True, strip: bool = True) -> Dict[str, str]:
+        """
+        Same as Client.get_many(), but non-blocking.
+
+        :param keys: keys to look for
+        :param default: value to return for a key that isn't found at any level, defaults to ""
+        :param template: shall the values be processed by the templating engine ? defaults to True
+        :param strip: shall the values be stripped off leading and trailing white spaces ? defaults to True
+        :return: the resulting values, by key
+        """
+
+        with self._memo() as (values, _):
+            values.update(await self._fetch_many(keys))
+            return {key: await self.get(key, default, template, strip) for key in keys}
+
+    async def close(self) -> None:
+        """ Closes the connections to the server. """
+
+        if self.http_session:
+            await self.http_session.close()
+            self.http_session = None
+
+    async def __aenter__(self) -> AsyncClient:
+        """ When used as an asynchronous context manager, returns the client itself. """
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        """ When used as an asynchronous context manager, closes the connections at the end of the "async with" block. """
+        await self.close()
+
+    @contextlib.contextmanager
+    def _memo(self) -> Iterator[Tuple[Dict[str, Optional[str]], List[str]]]:
+        """ Same as Client._memo(), but the state belongs to the current asyncio task rather than to the current thread. """
 
-        value = fetch(self.levels)  # let's try at the deepest level first
+        memo = ASYNC_MEMO.get()
+        if memo and memo[0] is self:  # nested call, from the "get" filter of a template being rendered
+            yield memo[1:]
+            return
 
-        value = self.jinja_environment.from_string(value).render() if template else value  # templating
+        token = ASYNC_MEMO.set((self, {}, []))
+        try:
+            yield ASYNC_MEMO.get()[1:]
+        finally:
+            ASYNC_MEMO.reset(token)
+
+    async def _prefetch(self, references: List[str]) -> None:
+        """ Same as Client._prefetch(), but non-blocking. """
+
+        values = ASYNC_MEMO.get()[1]
+        keys = [key for key in dict.fromkeys(references) if key not in values]
+        while keys:
+            values.update(await self._fetch_many(keys))
+            references = self._references([values[key] for key in keys])
+            keys = [key for key in dict.fromkeys(references) if key not in values]
+
+    async def _render(self, value: str, template: bool, strip: bool) -> str:
+        """ Same as Client._render(), but non-blocking. """
+
+        if template and any(marker in value for marker in TEMPLATE_MARKERS):
+            compiled_template, references = self.compile_template(value)
+            await self._prefetch(references)
+            value = await compiled_template.render_async()  # templating
         value = value.strip() if strip else value  # stripping
 
         return value
 
-    def save_configuration(self, configuration_file: Path = CONFIGURATION_FILE_DEFAULT) -> None:
+    async def _request(self, url: str) -> Optional[str]:
+        """ Same as Client._request(), but non-blocking, and sharing the http request with the concurrent calls for the same url. """
+
+        import asyncio  # already loaded by the running event loop
+
+        expiration, value = self.responses.get(url, (0, None))
+        if expiration > time.monotonic():
+            return value
+
+        if url not in self.pending_requests:
+            self.pending_requests[url] = asyncio.ensure_future(self._send(url))
+        return await asyncio.shield(self.pending_requests[url])  # a cancelled caller mustn't cancel the request for the others
+
+    async def _send(self, url: str) -> Optional[str]:
+        """ Actually sends the http request for _request(). """
+
+        if not self.http_session:
+            import aiohttp  # optional dependency, only required by the AsyncClient
+            self.http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.workers), timeout=aiohttp.ClientTimeout(total=SESSION_REGISTRY.timeout))
+
+        try:
+            async with self.http_session.get(url) as response:
+                if response.ok:
+                    value = await response.text()
+                    self.responses[url] = (time.monotonic() + self.cache, value)
+                    return value
+                if response.status == 404:
+                    self.missing_urls[url] = time.monotonic() + self.cache
+                return None
+        finally:
+            del self.pending_requests[url]
+
+    async def _fetch(self, key: str) -> Optional[str]:
+        """ Same as Client._fetch(), but non-blocking. """
+
+        import asyncio
+
+        snapshot = self._snapshot()
+        if key in snapshot:
+            return snapshot[key]
+
+        urls = self._urls(key)
+
+        if not self.concurrent_probing:
+            for depth, url in urls:
+                value = await self._request(url)
+                if value is not None:
+                    return self._resolved(key, depth, value)  # if the key is found, we return the value, if not we try at the parent level
+            return self._not_found(key, urls)
+
+        # all the levels are requested at once, but a deeper level always takes precedence over its parents
+        tasks = [(depth, asyncio.ensure_future(self._request(url))) for depth, url in urls]
+        try:
+            for depth, task in tasks:
+                value = await task
+                if value is not None:
+                    return self._resolved(key, depth, value)  # all the deeper levels have failed, this answer wins
+            return self._not_found(key, urls)
+        finally:
+            for _, task in tasks:
+                task.cancel()  # the remaining requests are useless, if no one else is waiting for them
+
+    async def _fetch_many(self, keys: List[str]) -> Dict[str, Optional[str]]:
+        """ Same as Client._fetch_many(), but non-blocking. """
+
+        import asyncio
+
+        snapshot = self._snapshot()
+        values = {key: snapshot[key] for key in keys if key in snapshot}
+        keys = [key for key in keys if key not in snapshot]
+
+        urls = {key: self._urls(key) for key in keys}
+
+        tasks = {}
+
+        def request(url):
+            if url not in tasks:  # urls shared by several keys are only requested once
+                tasks[url] = asyncio.ensure_future(self._request(url))
+            return tasks[url]
+
+        for key in keys:
+            for _, url in urls[key][:1] if self._is_resolved(key) else urls[key]:
+                request(url)
+
+        for key in keys:
+            for depth, url in urls[key]:
+                value = await request(url)
+                if value is not None:
+                    values[key] = self._resolved(key, depth, value)
+                    break
+            else:
+                values[key] = self._not_found(key, urls[key])
+        return values
+
+
+class SessionRegistry:
+    """
+    Process-wide registry of the http sessions of the Clients, one per server url (and cache duration, cache file, and stale-while-revalidate mode).
+    Each session pools its connections and caches the http responses (see requests-cache) for all the Clients of its url with the same cache duration.
+    The duration has to be part of the key, as a cached response keeps the expiration it was stored with, whichever Client reads it.
+    The connections to a host are bounded by the pool size: when they are all in use, the requests wait for one to be free.
+
+    The Clients use the SESSION_REGISTRY instance by default, that can be configured through its attributes:
+
+    >>> SESSION_REGISTRY.timeout = 10
+    >>> SESSION_REGISTRY.clear()  # the pool size and keep-alive only apply to the sessions created afterwards
+
+    :param pool_size: maximum number of connections to a host, defaults to 8
+    :param keep_alive: shall the connections be reused from one request to the next ? defaults to True
+    :param timeout: in seconds, the maximum duration of the connection and of each read, defaults to 30 seconds
+    """
+
+    def __init__(self, pool_size: int = POOL_SIZE_DEFAULT, keep_alive: bool = True, timeout: float = TIMEOUT_DEFAULT) -> None:
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.sessions = {}  # (url, cache duration, cache file, stale-while-revalidate) -> session
+        self.lock = threading.Lock()
+
+    def get(self, url: str, cache: int = CACHE_DEFAULT, cache_file: Optional[Path] = None, stale_while_revalidate: bool = False) -> requests_cache.CachedSession:
         """
-        Saves the Client's configuration to a JSON file.
+        Returns the session of a server url, created on first use.
 
-        :param configuration_file: path to the configuration file, defaults to /etc/zebr0.conf for a system-wide configuration
+        :param url: URL of the key-value server
+        :param cache: in seconds, the duration of the cache of http responses, defaults to 300 seconds
+        :param cache_file: path to an SQLite file where to persist the cache of http responses, defaults to an in-memory cache
+        :param stale_while_revalidate: shall an expired response be returned immediately, while it's refreshed in the background ? defaults to False
+        :return: the shared session
         """
 
-        configuration = {URL: self.url, LEVELS: self.levels, CACHE: self.cache}
-        configuration_string = json.dumps(configuration)
-        configuration_file.write_text(configuration_string, ENCODING)
+        key = (url, cache, cache_file, stale_while_revalidate)
+        with self.lock:
+            if key not in self.sessions:
+                self.sessions[key] = self._build(cache_file, stale_while_revalidate)
+            return self.sessions[key]
+
+    def clear(self) -> None:
+        """ Closes all the sessions, the Clients that already have one keep on using it though. """
+
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
+    def _build(self, cache_file: Optional[Path], stale_while_revalidate: bool) -> requests_cache.CachedSession:
+        """ Creates a session, the cache duration being up to each request. """
+
+        import requests
+        import requests_cache  # deferred, as importing it and its backends takes longer than many lookups
+
+        if cache_file:
+            session = requests_cache.CachedSession(str(cache_file), backend="sqlite", stale_while_revalidate=stale_while_revalidate, wal=True)  # write-ahead logging allows concurrent readers and writer
+        else:
+            session = requests_cache.CachedSession(backend="memory", stale_while_revalidate=stale_while_revalidate)
+
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.pool_size, pool_block=True)  # blocking keeps the number of sockets bounded
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+
+SESSION_REGISTRY = SessionRegistry()
+
+
+class FileCache:
+    """
+    Process-wide cache of the contents of the files read by the "read" filter, so that a file referenced many times is only read and decoded once.
+    A content is valid as long as the modification time, size and inode of its file don't change, which is checked at each read.
+    The least recently read contents are evicted when their total size exceeds the limit, and the larger files are never cached.
+    Files from a given size are memory-mapped rather than read, so that they are decoded without an intermediate copy.
+
+    The "read" filter uses the FILE_CACHE instance, that can be configured through its attributes.
+
+    :param max_size: in bytes, the maximum total size of the cached files, defaults to 64 MiB
+    :param mmap_threshold: in bytes, the size from which the files are memory-mapped, defaults to 1 MiB
+    """
+
+    def __init__(self, max_size: int = FILE_CACHE_SIZE_DEFAULT, mmap_threshold: int = MMAP_THRESHOLD_DEFAULT) -> None:
+        self.max_size = max_size
+        self.mmap_threshold = mmap_threshold
+        self.entries = collections.OrderedDict()  # (path, encoding) -> ((modification time, size, inode), content), from the least to the most recently read
+        self.size = 0  # total size of the cached files, in bytes
+        self.lock = threading.Lock()
+
+    def read(self, path: str, encoding: str = ENCODING) -> str:
+        """
+        Returns the content of a file, from the cache if it hasn't changed since.
+
+        :param path: path to the file
+        :param encoding: encoding of the file, defaults to "utf-8"
+        :return: the content of the file, or "" if it isn't a regular file
+        """
+
+        try:
+            status = os.stat(path)
+        except OSError:
+            return ""  # file not found
+        if not stat.S_ISREG(status.st_mode):
+            return ""
+
+        key, signature = (os.fspath(path), encoding), (status.st_mtime_ns, status.st_size, status.st_ino)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] == signature:
+                self.entries.move_to_end(key)
+                return entry[1]
+
+        content = self._load(path, encoding, status.st_size)
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[0][1]
+            if status.st_size <= self.max_size:
+                self.entries[key] = (signature, content)
+                self.size += status.st_size
+                while self.size > self.max_size:
+                    self.size -= self.entries.popitem(last=False)[1][0][1]
+        return content
+
+    def clear(self) -> None:
+        """ Empties the cache. """
+
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _load(self, path: str, encoding: str, size: int) -> str:
+        """ Actually reads and decodes a file for read(), with the same newline translation as Path.read_text(). """
+
+        with open(path, "rb") as file:
+            if size >= self.mmap_threshold and size > 0:  # an empty file can't be mapped
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                    content = str(mapping, encoding)
+            else:
+                content = str(file.read(), encoding)
+
+        if "\r" in content:
+            content = content.replace("\r\n", "\n").replace("\r", "\n")
+        return content
+
+
+FILE_CACHE = FileCache()
 
 
 class TestServer:
     """
     Rudimentary key-value HTTP server, for development or testing purposes only.
     The keys and their values are stored in a dictionary, that can be defined either in the constructor or through the "data" attribute.
-    Access logs are also available through the "access_logs" attribute.
+    Access logs are also available through the "access_logs" attribute, see AccessLogs.
+    Responses carry an ETag header, and conditional requests with a matching If-None-Match header are answered with a 304.
+
+    Bulk endpoint:
+    A request to "/?bundle=<prefix>&bundle=<prefix>..." returns, as a JSON dictionary, all the keys under the given prefixes and their values ("" being the root prefix).
+    A request to "/?manifest" returns, as a JSON dictionary, the list of all the existing keys under "keys", and a hash of this list under "version".
+    These responses are compressed if the client accepts gzip.
 
     Basic usage:
 
@@ -151,40 +1518,311 @@ class TestServer:
     >>>    server.data = {"key": "value", ...}
     >>>    ...
 
+    Engines:
+    The default "threading" engine is based on http.server, with a thread per connection and no keep-alive.
+    The "asyncio" engine serves all the connections from a single thread, with HTTP/1.1 persistent connections and pipelining, for load tests.
+
+    Fault injection:
+    To reproduce the behavior of a remote server across a WAN, the responses can be delayed, throttled, or replaced by errors.
+    The latency is either fixed (a number of seconds), uniformly distributed (a (min, max) tuple), or drawn from a histogram (a {seconds: weight} dictionary).
+    An error is either an HTTP status (e.g. 503), "reset" (the connection is reset without a response) or "slow-headers" (the headers are sent byte by byte).
+    These settings are attributes that can be changed at any time, and "overrides" can redefine them for given keys, e.g. {"key": {"latency": 2, "error_rate": 0}}.
+    With the "asyncio" engine, delayed responses don't block the other connections, and pipelined responses are still sent in order.
+
+    >>> with TestServer(data, latency=(0.05, 0.2), error_rate=0.01, errors=[503, "reset"]) as server:
+    >>>    ...
+
     :param data: the keys and their values stored in a dictionary, defaults to an empty dictionary
     :param address: the address the server will be listening to, defaults to 127.0.0.1
     :param port: the port the server will be listening to, defaults to 8000
+    :param engine: "threading" or "asyncio", defaults to "threading"
+    :param access_logs_size: maximum number of entries kept in the access logs, defaults to no limit
+    :param latency: delay before each response, fixed, uniform or from a histogram, defaults to none
+    :param bandwidth: maximum speed at which the bodies are sent, in bytes per second, defaults to no limit
+    :param error_rate: probability for a request to get an error instead of its response, defaults to 0
+    :param errors: the errors to choose from, with equal probability, defaults to [500]
+    :param overrides: settings for given keys, overriding the ones above, defaults to none
     """
 
-    def __init__(self, data: dict = None, address: str = "127.0.0.1", port: int = 8000) -> None:
+    def __init__(self, data: dict = None, address: str = "127.0.0.1", port: int = 8000, engine: str = THREADING, access_logs_size: Optional[int] = None,
+                 latency: Union[None, float, Tuple[float, float], Dict[float, float]] = None, bandwidth: Optional[int] = None, error_rate: float = 0,
+                 errors: List[Union[int, str]] = None, overrides: Dict[str, dict] = None) -> None:
         self.data = data or {}
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.errors = errors or [500]
+        self.overrides = overrides or {}
+        self.access_logs_size = access_logs_size
         self.access_logs = []
+        self.engine = engine
+
+        if engine == THREADING:
+            self.server = self._threading_server(address, port)
+        elif engine == ASYNCIO:
+            import asyncio  # deferred, like http.server, as only the TestServer needs it
+
+            self.server = socket.create_server((address, port))  # bound right away, like the http.server one
+            self.loop = asyncio.new_event_loop()
+            self.connections = set()
+        else:
+            raise ValueError(f"unknown engine: {engine}")
+
+    @property
+    def access_logs(self) -> AccessLogs:
+        """ The paths of the requests, in the order they were answered. """
+        return self._access_logs
+
+    @access_logs.setter
+    def access_logs(self, paths: List[str]) -> None:
+        """ Resets the access logs, e.g. "server.access_logs = []". """
+        self._access_logs = AccessLogs(paths, self.access_logs_size)
+
+    def _threading_server(self, address: str, port: int) -> http.server.ThreadingHTTPServer:
+        """ Builds the server of the "threading" engine. """
+
+        import http.server
 
         class RequestHandler(http.server.BaseHTTPRequestHandler):
             def do_GET(zelf):
-                key = zelf.path[1:]  # the key is the request's path, minus the leading "/"
-                value = self.data.get(key)
+                delay, error, bandwidth = self._faults(zelf.path)
+                time.sleep(delay)
+
+                if error == RESET:
+                    zelf.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))  # closing the socket will then reset the connection
+                    zelf.close_connection = True
+                    self.access_logs.append(zelf.path)
+                else:
+                    status, headers, body = (error, {}, b"") if isinstance(error, int) else self.handle(zelf.path, zelf.headers)
+                    headers["Content-Length"] = str(len(body))
+                    head = self._head(zelf.protocol_version, status, headers)
+                    self.access_logs.append(zelf.path)  # before sending the response, so that the client can't check the logs too early
+
+                    try:
+                        for chunk, pause in self._chunks(head, body, error == SLOW_HEADERS, bandwidth):
+                            zelf.wfile.write(chunk)
+                            time.sleep(pause)
+                    except ConnectionError:  # e.g. the client timed out
+                        zelf.close_connection = True
+
+        return http.server.ThreadingHTTPServer((address, port), RequestHandler)
+
+    def _serve_asyncio(self) -> None:
+        """ Runs the event loop of the "asyncio" engine, until stop() is called. """
+
+        import asyncio
+
+        server = self
+
+        class HTTPProtocol(asyncio.Protocol):
+            def __init__(zelf):
+                zelf.transport = None
+                zelf.buffer = b""
+                zelf.pending = None  # task sending the last delayed response, that the next responses must wait for
+
+            def connection_made(zelf, transport):
+                zelf.transport = transport
+                server.connections.add(transport)
 
-                if value:  # standard HTTP REST behavior
-                    zelf.send_response(200)
-                    zelf.end_headers()
-                    zelf.wfile.write(str(value).encode(ENCODING))
+            def connection_lost(zelf, exc):
+                server.connections.discard(zelf.transport)
+
+            def data_received(zelf, data):
+                zelf.buffer += data
+
+                while not zelf.transport.is_closing():  # pipelined requests are answered in order
+                    end = zelf.buffer.find(b"\r\n\r\n")
+                    if end < 0:
+                        if len(zelf.buffer) > 65536:
+                            zelf.transport.close()  # headers too large
+                        return
+
+                    request_line, *header_lines = zelf.buffer[:end].decode("latin-1").split("\r\n")
+                    headers = {}
+                    for line in header_lines:
+                        name, _, value = line.partition(":")
+                        headers[name.strip().title()] = value.strip()
+
+                    length = end + 4 + int(headers.get("Content-Length", 0))
+                    if len(zelf.buffer) < length:
+                        return  # the body hasn't been fully received yet
+                    zelf.buffer = zelf.buffer[length:]
+
+                    method, path, version = (request_line.split(" ") + ["", "", ""])[:3]
+                    delay, error, bandwidth = server._faults(path) if method == "GET" else (0, None, None)
+
+                    if delay or error or bandwidth or (zelf.pending and not zelf.pending.done()):
+                        zelf.pending = server.loop.create_task(zelf.respond_later(zelf.pending, method, path, version, headers, delay, error, bandwidth))
+                    else:  # fast path
+                        head, body, keep_alive = zelf.response(method, path, version, headers, None)
+                        zelf.transport.write(head + body)
+                        if not keep_alive:
+                            zelf.transport.close()
+
+            def response(zelf, method, path, version, headers, error):
+                if method != "GET":
+                    status, response_headers, body = 501, {}, b""
+                elif isinstance(error, int):
+                    status, response_headers, body = error, {}, b""
+                else:
+                    status, response_headers, body = server.handle(path, headers)
+
+                if version == "HTTP/1.1":
+                    keep_alive = headers.get("Connection", "").lower() != "close"
                 else:
-                    zelf.send_response(404)
-                    zelf.end_headers()
+                    keep_alive = headers.get("Connection", "").lower() == "keep-alive"
+
+                response_headers["Content-Length"] = str(len(body))
+                response_headers["Connection"] = "keep-alive" if keep_alive else "close"
+                if method == "GET":
+                    server.access_logs.append(path)  # before sending the response, so that the client can't check the logs too early
+                return server._head("HTTP/1.1", status, response_headers), body, keep_alive
+
+            async def respond_later(zelf, previous, method, path, version, headers, delay, error, bandwidth):
+                if previous:
+                    await previous
+                await asyncio.sleep(delay)
+                if zelf.transport.is_closing():
+                    return
+
+                if error == RESET:
+                    zelf.transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                    zelf.transport.abort()
+                    server.access_logs.append(path)
+                    return
+
+                head, body, keep_alive = zelf.response(method, path, version, headers, error)
+                for chunk, pause in server._chunks(head, body, error == SLOW_HEADERS, bandwidth):
+                    if zelf.transport.is_closing():  # e.g. the client timed out
+                        return
+                    zelf.transport.write(chunk)
+                    await asyncio.sleep(pause)
+                if not keep_alive:
+                    zelf.transport.close()
+
+        asyncio.set_event_loop(self.loop)
+        asyncio_server = self.loop.run_until_complete(self.loop.create_server(HTTPProtocol, sock=self.server))
+        self.loop.run_forever()
+
+        for task in asyncio.all_tasks(self.loop):
+            task.cancel()  # delayed responses that haven't been sent yet
+        for transport in list(self.connections):
+            transport.close()
+        asyncio_server.close()
+        self.loop.run_until_complete(asyncio.sleep(0))  # lets the transports actually close
+        self.loop.close()
+
+    def handle(self, path: str, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        """
+        Answers a GET request, whatever the underlying http server.
+
+        :param path: path of the request
+        :param headers: headers of the request
+        :return: the status, headers and body of the response
+        """
+
+        if path.startswith("/?"):  # bulk requests, that can't be mistaken for a key
+            query = urllib.parse.parse_qs(path[2:], keep_blank_values=True)
+            if BUNDLE in query:
+                prefixes = query[BUNDLE]
+                bulk = {key: str(value) for key, value in self.data.items() if value and any(not prefix or key.startswith(prefix + "/") for prefix in prefixes)}
+            elif MANIFEST in query:
+                keys = sorted(key for key, value in self.data.items() if value)
+                bulk = {VERSION: hashlib.sha1("\n".join(keys).encode(ENCODING)).hexdigest(), KEYS: keys}
+            else:
+                return 400, {}, b""
+
+            body = json.dumps(bulk).encode(ENCODING)
+            response_headers = {"Content-Type": "application/json"}
+        else:
+            key = path[1:]  # the key is the request's path, minus the leading "/"
+            value = self.data.get(key)
+            if not value:  # standard HTTP REST behavior
+                return 404, {}, b""
+
+            body = str(value).encode(ENCODING)
+            response_headers = {}
+
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""  # the client's copy is still valid
+
+        response_headers["ETag"] = etag
+        if "gzip" in headers.get("Accept-Encoding", "") and response_headers.get("Content-Type") == "application/json":
+            body = gzip.compress(body)
+            response_headers["Content-Encoding"] = "gzip"
+        return 200, response_headers, body
+
+    def _faults(self, path: str) -> Tuple[float, Union[None, int, str], Optional[int]]:
+        """
+        Draws the faults to inject in the response to a request, according to the settings of its key.
+
+        :param path: path of the request
+        :return: the delay before the response, the error replacing it if any, and the bandwidth limit if any
+        """
+
+        settings = {LATENCY: self.latency, BANDWIDTH: self.bandwidth, ERROR_RATE: self.error_rate, ERRORS: self.errors}
+        settings.update(self.overrides.get(path[1:], {}))
+
+        latency = settings[LATENCY]
+        if isinstance(latency, tuple):
+            delay = random.uniform(*latency)
+        elif isinstance(latency, dict):
+            delay = random.choices(list(latency.keys()), weights=list(latency.values()))[0]
+        else:
+            delay = latency or 0
+
+        error = random.choice(settings[ERRORS]) if random.random() < settings[ERROR_RATE] else None
+        return delay, error, settings[BANDWIDTH]
 
-                self.access_logs.append(zelf.path)
+    @staticmethod
+    def _head(version: str, status: int, headers: Dict[str, str]) -> bytes:
+        """ Builds the status line and the headers of a response. """
+        return (f"{version} {status} {http.HTTPStatus(status).phrase}\r\n" + "".join(f"{name}: {value}\r\n" for name, value in headers.items()) + "\r\n").encode("latin-1")
 
-        self.server = http.server.ThreadingHTTPServer((address, port), RequestHandler)
+    @staticmethod
+    def _chunks(head: bytes, body: bytes, slow_headers: bool, bandwidth: Optional[int]) -> Iterator[Tuple[bytes, float]]:
+        """
+        Splits a response into the chunks to send, each followed by a pause, to simulate slow headers or a limited bandwidth.
+
+        :param head: status line and headers of the response
+        :param body: body of the response
+        :param slow_headers: shall the headers be sent byte by byte?
+        :param bandwidth: maximum speed at which the body is sent, in bytes per second, or None
+        :return: an iterator over the chunks and the pause following each of them
+        """
+
+        if slow_headers:
+            for i in range(len(head)):
+                yield head[i:i + 1], SLOW_HEADERS_INTERVAL
+        if bandwidth:
+            size = max(1, int(bandwidth * BANDWIDTH_INTERVAL))
+            if not slow_headers:
+                yield head, 0
+            for i in range(0, len(body), size):
+                yield body[i:i + size], len(body[i:i + size]) / bandwidth
+        else:
+            yield (body if slow_headers else head + body), 0
 
     def start(self) -> None:
         """ Starts the server in a separate thread. """
-        threading.Thread(target=self.server.serve_forever).start()
+
+        if self.engine == THREADING:
+            threading.Thread(target=self.server.serve_forever).start()
+        else:
+            self.thread = threading.Thread(target=self._serve_asyncio)
+            self.thread.start()
 
     def stop(self) -> None:
         """ Stops the server. """
-        self.server.shutdown()
-        self.server.server_close()
+
+        if self.engine == THREADING:
+            self.server.shutdown()
+            self.server.server_close()
+        else:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.server.close()
 
     def __enter__(self) -> TestServer:
         """ When used as a context manager, starts the server at the beginning of the "with" block. """
@@ -196,17 +1834,53 @@ class TestServer:
         self.stop()
 
 
+class AccessLogs(collections.deque):
+    """
+    Access logs of the TestServer: the paths of the requests, in the order they were answered.
+    They behave like a list (and are equal to the list of the same paths), but are safe to use from several threads.
+    If a size is given, only the most recent entries are kept, while the counters keep track of all the requests.
+
+    :param paths: initial entries, defaults to none
+    :param size: maximum number of entries, defaults to no limit
+    """
+
+    def __init__(self, paths: List[str] = (), size: Optional[int] = None) -> None:
+        super().__init__(paths, size)
+        self.lock = threading.Lock()
+        self.total = len(self)  # number of requests
+        self.counters = collections.Counter(self)  # number of requests by path
+
+    def append(self, path: str) -> None:
+        """ Logs a request. """
+
+        with self.lock:
+            super().append(path)  # the oldest entry is dropped if the maximum size is reached
+            self.total += 1
+            self.counters[path] += 1
+
+    def __getitem__(self, index):
+        """ Also supports slices, like a list. """
+        return list(self)[index] if isinstance(index, slice) else super().__getitem__(index)
+
+    def __eq__(self, other: Any) -> bool:
+        """ Access logs are equal to the list of the same paths. """
+        return list(self) == other if isinstance(other, list) else super().__eq__(other)
+
+    def __ne__(self, other: Any) -> bool:
+        return not self == other
+
+
 def read(path: str, encoding: str = ENCODING) -> str:
     """
     Filter for the Jinja templating engine, that allows to read a file's content.
+    The contents are cached until the files change, see FileCache.
 
     :param path: path to the file
     :param encoding: encoding of the file, defaults to "utf-8"
     :return: the content of the file
     """
 
-    path = Path(path)
-    return path.read_text(encoding=encoding) if path.is_file() else ""
+    return FILE_CACHE.read(path, encoding)
 
 
 def build_argument_parser(*args: Any, **kwargs: Any) -> argparse.ArgumentParser:
@@ -226,14 +1900,24 @@ def build_argument_parser(*args: Any, **kwargs: Any) -> argparse.ArgumentParser:
     argparser.add_argument("-u", "--url", help="URL of the key-value server, defaults to https://hub.zebr0.io", metavar="<url>")
     argparser.add_argument("-l", "--levels", nargs="*", help='levels of specialization (e.g. "mattermost production" for a <project>/<environment>/<key> structure), defaults to ""', metavar="<level>")
     argparser.add_argument("-c", "--cache", type=int, help="in seconds, the duration of the cache of http responses, defaults to 300 seconds", metavar="<duration>")
+    argparser.add_argument("--cache-file", type=Path, help="path to an SQLite file where to persist the cache of http responses, defaults to an in-memory cache", metavar="<path>")
+    argparser.add_argument("--snapshot-file", type=Path, help="path to a snapshot file, from which the keys are read first, defaults to no snapshot", metavar="<path>")
+    argparser.add_argument("--replicas", nargs="*", help="URLs of other key-value servers with the same keys, to fail over to, defaults to none", metavar="<url>")
     argparser.add_argument("-f", "--configuration-file", type=Path, default=CONFIGURATION_FILE_DEFAULT, help=f"path to the configuration file, defaults to {CONFIGURATION_FILE_DEFAULT} for a system-wide configuration", metavar="<path>")
 
     return argparser
 
 
+def print_stats(client: Client) -> None:
+    """ Prints the figures of all the top-level calls of a Client on the standard error, see Instrumentation. """
+
+    for name, value in client.stats().items():
+        print(f"{name}: {value * 1000:.3f}ms" if isinstance(value, float) else f"{name}: {value}", file=sys.stderr)
+
+
 def main(args: Optional[List[str]] = None) -> None:
     """
-    usage: zebr0-setup [-h] [-u <url>] [-l [<level> [<level> ...]]] [-c <duration>] [-f <path>] [-t <key>]
+    usage: zebr0-setup [-h] [-u <url>] [-l [<level> [<level> ...]]] [-c <duration>] [--cache-file <path>] [--snapshot-file <path>] [--replicas [<url> [<url> ...]]] [-f <path>] [-t <key>] [-s <key> [<key> ...]] [--stats]
 
     Saves zebr0's configuration in a JSON file.
 
@@ -245,21 +1929,99 @@ def main(args: Optional[List[str]] = None) -> None:
                             levels of specialization (e.g. "mattermost production" for a <project>/<environment>/<key> structure), defaults to ""
       -c <duration>, --cache <duration>
                             in seconds, the duration of the cache of http responses, defaults to 300 seconds
+      --cache-file <path>   path to an SQLite file where to persist the cache of http responses, defaults to an in-memory cache
+      --snapshot-file <path>
+                            path to a snapshot file, from which the keys are read first, defaults to no snapshot
+      --replicas [<url> [<url> ...]]
+                            URLs of other key-value servers with the same keys, to fail over to, defaults to none
       -f <path>, --configuration-file <path>
                             path to the configuration file, defaults to /etc/zebr0.conf for a system-wide configuration
       -t <key>, --test <key>
                             tests the configuration by fetching a key (e.g. 'fqdn')
+      -s <key> [<key> ...], --snapshot <key> [<key> ...]
+                            resolves some keys and saves them in the snapshot file (e.g. 'fqdn')
+      --stats               with --test, prints the figures of the lookup on the standard error, see Client's Instrumentation
     """
 
     argparser = build_argument_parser(description="Saves zebr0's configuration in a JSON file.")
     argparser.add_argument("-t", "--test", help="tests the configuration by fetching a key (e.g. 'fqdn')", metavar="<key>")
+    argparser.add_argument("-s", "--snapshot", nargs="+", help="resolves some keys and saves them in the snapshot file (e.g. 'fqdn')", metavar="<key>")
+    argparser.add_argument("--stats", action="store_true", help="with --test, prints the figures of the lookup on the standard error, see Client's Instrumentation")
     args = argparser.parse_args(args)
 
+    if args.snapshot and not args.snapshot_file:
+        argparser.error("--snapshot requires --snapshot-file")
+    if args.stats and not args.test:
+        argparser.error("--stats requires --test")
+
     # creates a client from the given parameters, then saves the configuration
-    client = Client(args.url, args.levels, args.cache)
+    client = Client(args.url, args.levels, args.cache, cache_file=args.cache_file, snapshot_file=args.snapshot_file, replicas=args.replicas)
     client.save_configuration(args.configuration_file)
 
+    if args.snapshot:
+        # creates a client from the configuration file, then compiles the snapshot
+        client = Client(configuration_file=args.configuration_file)
+        client.save_snapshot(args.snapshot)
+
     if args.test:
         # creates a client from the configuration file, then tests the configuration
         client = Client(configuration_file=args.configuration_file)
         print(client.get(args.test))
+
+        if args.stats:
+            print_stats(client)
+
+
+def main_render(args: Optional[List[str]] = None) -> None:
+    """
+    usage: zebr0-render [-h] [-u <url>] [-l [<level> [<level> ...]]] [-c <duration>] [--cache-file <path>] [--snapshot-file <path>] [--replicas [<url> [<url> ...]]] [-f <path>] [-w <workers>] [--stats] <manifest>
+
+    Renders many keys to files at once, each file being written atomically and only if its content changed, and none at all if a key can't be resolved.
+
+    positional arguments:
+      <manifest>            path to a JSON file of the keys to render, with the path of their file (e.g. {"nginx.conf": "/etc/nginx/nginx.conf"})
+
+    optional arguments:
+      -h, --help            show this help message and exit
+      -u <url>, --url <url>
+                            URL of the key-value server, defaults to https://hub.zebr0.io
+      -l [<level> [<level> ...]], --levels [<level> [<level> ...]]
+                            levels of specialization (e.g. "mattermost production" for a <project>/<environment>/<key> structure), defaults to ""
+      -c <duration>, --cache <duration>
+                            in seconds, the duration of the cache of http responses, defaults to 300 seconds
+      --cache-file <path>   path to an SQLite file where to persist the cache of http responses, defaults to an in-memory cache
+      --snapshot-file <path>
+                            path to a snapshot file, from which the keys are read first, defaults to no snapshot
+      --replicas [<url> [<url> ...]]
+                            URLs of other key-value servers with the same keys, to fail over to, defaults to none
+      -f <path>, --configuration-file <path>
+                            path to the configuration file, defaults to /etc/zebr0.conf for a system-wide configuration
+      -w <workers>, --workers <workers>
+                            maximum number of concurrent http requests and file writes, defaults to 8
+      --stats               prints the figures of the lookups on the standard error, see Client's Instrumentation
+    """
+
+    argparser = build_argument_parser(description="Renders many keys to files at once, each file being written atomically and only if its content changed, and none at all if a key can't be resolved.")
+    argparser.add_argument("manifest", type=Path, help='path to a JSON file of the keys to render, with the path of their file (e.g. {"nginx.conf": "/etc/nginx/nginx.conf"})', metavar="<manifest>")
+    argparser.add_argument("-w", "--workers", type=int, default=WORKERS_DEFAULT, help=f"maximum number of concurrent http requests and file writes, defaults to {WORKERS_DEFAULT}", metavar="<workers>")
+    argparser.add_argument("--stats", action="store_true", help="prints the figures of the lookups on the standard error, see Client's Instrumentation")
+    args = argparser.parse_args(args)
+
+    import requests
+
+    manifest = json.loads(args.manifest.read_text(ENCODING))
+
+    # a single client for all the keys, so that the references they share are fetched only once
+    client = Client(args.url, args.levels, args.cache, configuration_file=args.configuration_file, cache_file=args.cache_file, snapshot_file=args.snapshot_file, replicas=args.replicas, workers=args.workers)
+    try:
+        written = client.render_to_files(manifest)
+    except (LookupError, requests.HTTPError) as exception:
+        argparser.exit(1, f"{exception}\n")  # no file was written
+
+    # prints the paths of the files that changed, e.g. to reload the services they configure
+    for key, path in manifest.items():
+        if written[key]:
+            print(path)
+
+    if args.stats:
+        print_stats(client)